@@ -22,23 +22,123 @@ Usage:
 """
 
 import os
+import re
 import sys
 import json
+import time
+import hashlib
 import requests
 import argparse
-from typing import List, Dict, Any
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+from typing import List, Dict, Any, Iterable, Iterator, Optional
 from dataclasses import dataclass
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+# Optional: faster JSON parsing when orjson is installed
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
 
-# Import LangChain components
-from langchain_google_genai import GoogleGenerativeAI
-from langchain.prompts import PromptTemplate
-from langchain.schema import HumanMessage, SystemMessage
+# Seconds a GitHub API request may wait to connect or between received bytes
+GITHUB_FETCH_TIMEOUT = 60
 
-@dataclass
+# Attempts for transient GitHub (429/5xx) and Gemini failures
+GITHUB_MAX_RETRIES = 5
+LLM_MAX_RETRIES = 5
+
+# Read size when streaming PR diffs from GitHub
+DIFF_CHUNK_SIZE = 65536
+
+# SQLite file used to cache LLM responses across runs; CI restores it per PR with actions/cache
+LLM_CACHE_PATH = ".llm_cache.db"
+
+# Directory that keeps ETag-validated GitHub responses between runs, one file per request
+ETAG_CACHE_DIR = ".github-etag-cache"
+
+# Cached responses not used for this many seconds are deleted when a client starts
+ETAG_CACHE_MAX_AGE = 7 * 24 * 3600
+
+# Matches the File/Line/Issue/Suggestion entries of the AI review format
+REVIEW_LINE_RE = re.compile(
+    r'^\s*(?:-\s*)?\*\*(?:'
+    r'File\*\*:\s*(?P<file>.+?)'
+    r'|Line\*\*:\s*(?P<line>\d+).*?'
+    r'|Issue\*\*:\s*(?P<issue>.+?)'
+    r'|Suggestion\*\*:\s*(?P<suggestion>.+?)'
+    r')\s*$'
+)
+
+# Generated, vendored and binary files that are never sent to the LLM
+SKIPPED_FILE_SUFFIXES = (
+    ".lock", ".min.js", ".min.css", ".map",
+    ".png", ".jpg", ".jpeg", ".gif", ".ico", ".pdf", ".zip", ".woff", ".woff2",
+)
+SKIPPED_FILE_NAMES = {"package-lock.json", "yarn.lock", "pnpm-lock.yaml"}
+
+# Files with more changed lines than this are left out of the AI review
+MAX_FILE_CHANGES = 1000
+
+# Diffs larger than this are split by file into several LLM requests
+MAX_DIFF_CHUNK_CHARS = 32000
+
+# Maximum number of LLM requests in flight for one review
+LLM_MAX_CONCURRENCY = 4
+
+# First line of a per-file diff section whose path is unchanged: diff --git a/<path> b/<path>
+DIFF_HEADER_RE = re.compile(r'^diff --git a/(.+) b/\1$', re.MULTILINE)
+
+# New path in the header of a section that renames its file: +++ b/<new>
+NEW_PATH_RE = re.compile(r'^\+\+\+ b/(.+)$', re.MULTILINE)
+
+# Fallback for sections with neither, such as deletions and pure renames
+RENAME_HEADER_RE = re.compile(r'^diff --git a/.+? b/(.+)$', re.MULTILINE)
+
+# Severity buckets rendered in the PR comment, in display order
+SEVERITY_SECTIONS = (
+    ("error", "❌ Errors Found"),
+    ("warning", "⚠️ Warnings"),
+    ("info", "ℹ️ Suggestions"),
+)
+
+# Output instructions appended after the code changes in every review prompt
+REVIEW_PROMPT_TRAILER = """
+Please provide a comprehensive review that includes:
+1. Overall assessment of the changes
+2. Specific issues found (if any) with line numbers
+3. Suggestions for improvement
+4. Security considerations
+5. Performance implications
+6. Code quality observations
+
+Format your response as:
+## Code Review Summary
+[Overall assessment]
+
+## Issues Found
+- **File**: [filename]
+  - **Line**: [line number]
+  - **Issue**: [description]
+  - **Severity**: [error/warning/info]
+  - **Suggestion**: [how to fix]
+
+## Recommendations
+[General recommendations for improvement]
+"""
+
+def diff_section_path(section: str) -> str:
+    """Get the new file path from a single-file diff section"""
+    match = DIFF_HEADER_RE.match(section)
+    if not match:
+        # Only look before the first hunk, where "+++" cannot be an added line
+        match = NEW_PATH_RE.search(section.split("\n@@", 1)[0]) or RENAME_HEADER_RE.match(section)
+    return match.group(1) if match else ""
+
+@dataclass(slots=True, frozen=True)
 class CodeReviewRule:
     """Represents a code review rule"""
     name: str
@@ -47,7 +147,7 @@ class CodeReviewRule:
     pattern: str
     suggestion: str
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class CodeReviewResult:
     """Represents the result of a code review"""
     file_path: str
@@ -65,39 +165,119 @@ class GitHubAPIClient:
         self.owner = owner
         self.repo = repo
         self.base_url = f"https://api.github.com/repos/{owner}/{repo}"
-        self.headers = {
-            "Authorization": f"token {token}",
-            "Accept": "application/vnd.github.v3+json"
-        }
-    
-    def get_pr_diff(self, pr_number: int) -> str:
-        """Get the diff for a pull request"""
-        url = f"{self.base_url}/pulls/{pr_number}"
-        response = requests.get(url, headers=self.headers)
-        response.raise_for_status()
         
-        # Get the diff URL
-        pr_data = response.json()
-        diff_url = pr_data["diff_url"]
+        # Reuse one pooled HTTPS connection and one set of headers across all API calls
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"token {token}",
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+            # Includes br/zstd when the matching decoders are installed
+            "Accept-Encoding": make_headers(accept_encoding=True)["accept-encoding"]
+        })
+        # Back off exponentially on rate limits and transient server errors,
+        # honouring Retry-After. POST is not retried to avoid duplicate comments.
+        retries = Retry(total=GITHUB_MAX_RETRIES, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries))
         
-        # Fetch the actual diff
-        diff_response = requests.get(diff_url, headers=self.headers)
-        diff_response.raise_for_status()
+        # Conditional-request cache shared by the diff and files fetches
+        self._prune_etag_cache()
+    
+    def _etag_cache_path(self, key: str) -> str:
+        """Get the file caching the response for a request key"""
+        return os.path.join(ETAG_CACHE_DIR, hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest())
+    
+    def _prune_etag_cache(self) -> None:
+        """Delete cached responses unused for ETAG_CACHE_MAX_AGE seconds, including abandoned temp files"""
+        try:
+            entries = list(os.scandir(ETAG_CACHE_DIR))
+        except FileNotFoundError:
+            return
+        cutoff = time.time() - ETAG_CACHE_MAX_AGE
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+    
+    def _iter_cached(self, url: str, accept: Optional[str] = None) -> Iterator[bytes]:
+        """Stream a GET response, revalidating any cached copy with If-None-Match"""
+        headers = {"Accept": accept} if accept else {}
+        path = self._etag_cache_path(f"{accept or self.session.headers['Accept']} {url}")
+        try:
+            cached = open(path, "rb")
+        except FileNotFoundError:
+            cached = None
         
-        return diff_response.text
+        try:
+            # A cache file holds the ETag on its first line, then the body bytes as received
+            if cached:
+                headers["If-None-Match"] = cached.readline().rstrip(b"\n").decode("latin-1")
+            
+            with self.session.get(url, headers=headers, stream=True, timeout=GITHUB_FETCH_TIMEOUT) as response:
+                # Not modified: reuse the stored body, which costs no rate limit
+                if response.status_code == 304 and cached:
+                    os.utime(path)
+                    yield from iter(lambda: cached.read(DIFF_CHUNK_SIZE), b"")
+                    return
+                response.raise_for_status()
+                
+                etag = response.headers.get("ETag")
+                if etag:
+                    yield from self._stream_to_cache(response, path, etag)
+                else:
+                    yield from response.iter_content(chunk_size=DIFF_CHUNK_SIZE)
+        finally:
+            if cached:
+                cached.close()
+    
+    def _stream_to_cache(self, response: requests.Response, path: str, etag: str) -> Iterator[bytes]:
+        """Yield a response body while saving it, replacing the cache file only once the body is complete"""
+        os.makedirs(ETAG_CACHE_DIR, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(etag.encode("latin-1") + b"\n")
+                for chunk in response.iter_content(chunk_size=DIFF_CHUNK_SIZE):
+                    f.write(chunk)
+                    yield chunk
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def _iter_diff_chunks(self, pr_number: int) -> Iterator[bytes]:
+        """Stream the raw diff bytes for a pull request"""
+        url = f"{self.base_url}/pulls/{pr_number}"
+        # Ask for the diff media type directly instead of following diff_url
+        return self._iter_cached(url, "application/vnd.github.v3.diff")
+    
+    def iter_diff_files(self, pr_number: int) -> Iterator[str]:
+        """Yield the diff of a pull request one file section at a time"""
+        pending = b""
+        section = []
+        for chunk in self._iter_diff_chunks(pr_number):
+            *lines, pending = (pending + chunk).split(b"\n")
+            for line in lines:
+                if line.startswith(b"diff --git") and section:
+                    yield b"\n".join(section).decode("utf-8", errors="replace") + "\n"
+                    section = []
+                section.append(line)
+        if section or pending:
+            tail = b"\n".join(section) + b"\n" if section else b""
+            yield (tail + pending).decode("utf-8", errors="replace")
     
     def get_pr_files(self, pr_number: int) -> List[Dict[str, Any]]:
         """Get the list of files changed in a pull request"""
         url = f"{self.base_url}/pulls/{pr_number}/files"
-        response = requests.get(url, headers=self.headers)
-        response.raise_for_status()
-        return response.json()
+        return _json_loads(b"".join(self._iter_cached(url)))
     
     def post_comment(self, pr_number: int, comment: str) -> None:
         """Post a comment to a pull request"""
         url = f"{self.base_url}/issues/{pr_number}/comments"
         data = {"body": comment}
-        response = requests.post(url, headers=self.headers, json=data)
+        response = self.session.post(url, json=data, timeout=GITHUB_FETCH_TIMEOUT)
         response.raise_for_status()
 
 class CodeReviewBot:
@@ -105,14 +285,24 @@ class CodeReviewBot:
     
     def __init__(self, github_client: GitHubAPIClient):
         self.github_client = github_client
-        self.llm = GoogleGenerativeAI(model="models/gemini-2.5-pro")
+        
+        # Import LangChain components only when a bot is actually created
+        from langchain_google_genai import GoogleGenerativeAI
+        from langchain.globals import set_llm_cache
+        from langchain_community.cache import SQLiteCache
+        
+        # Identical prompts for the same model are answered from the local cache
+        set_llm_cache(SQLiteCache(database_path=LLM_CACHE_PATH))
+        # The Gemini client retries rate-limited and unavailable responses with backoff
+        self.llm = GoogleGenerativeAI(model="models/gemini-2.5-pro", max_retries=LLM_MAX_RETRIES)
         self.rules = self._load_review_rules()
+        self._prompt_prefix = self._build_prompt_prefix(self.rules)
     
     def _load_review_rules(self) -> List[CodeReviewRule]:
         """Load code review rules from configuration"""
         try:
-            with open(".github/code-review/config.json", "r") as f:
-                config = json.load(f)
+            with open(".github/code-review/config.json", "rb") as f:
+                config = _json_loads(f.read())
             
             rules = []
             for rule_config in config.get("rules", []):
@@ -156,131 +346,151 @@ class CodeReviewBot:
             )
         ]
     
-    def _create_review_prompt(self, diff: str, rules: List[CodeReviewRule]) -> str:
-        """Create a prompt for AI code review"""
+    def _build_prompt_prefix(self, rules: List[CodeReviewRule]) -> str:
+        """Build the stable instructions and rules part of the review prompt"""
         rules_text = "\n".join([
             f"- {rule.name}: {rule.description} (Severity: {rule.severity})"
             for rule in rules
         ])
         
-        prompt = f"""
+        return f"""
 You are an expert code reviewer. Please review the following code changes and provide feedback based on these rules:
 
 RULES:
 {rules_text}
-
-CODE CHANGES:
-{diff}
-
-Please provide a comprehensive review that includes:
-1. Overall assessment of the changes
-2. Specific issues found (if any) with line numbers
-3. Suggestions for improvement
-4. Security considerations
-5. Performance implications
-6. Code quality observations
-
-Format your response as:
-## Code Review Summary
-[Overall assessment]
-
-## Issues Found
-- **File**: [filename]
-  - **Line**: [line number]
-  - **Issue**: [description]
-  - **Severity**: [error/warning/info]
-  - **Suggestion**: [how to fix]
-
-## Recommendations
-[General recommendations for improvement]
 """
-        return prompt
+    
+    def _create_review_prompt(self, diff: str) -> str:
+        """Create a prompt for AI code review"""
+        # Keep the invariant part first so provider-side prefix caching can reuse it
+        return f"{self._prompt_prefix}\nCODE CHANGES:\n{diff}\n{REVIEW_PROMPT_TRAILER}"
     
     def review_pr(self, pr_number: int) -> List[CodeReviewResult]:
         """Review a pull request and return results"""
         print(f"Reviewing PR #{pr_number}...")
         
-        # Get PR diff and files
-        diff = self.github_client.get_pr_diff(pr_number)
-        files = self.github_client.get_pr_files(pr_number)
-        
-        print(f"Found {len(files)} changed files")
-        
-        # Create AI review prompt
-        prompt = self._create_review_prompt(diff, self.rules)
-        
-        # Get AI review
-        print("Getting AI review...")
-        ai_review = self.llm.invoke(prompt)
-        
-        # Parse AI review and create results
-        results = self._parse_ai_review(ai_review, files)
+        with ThreadPoolExecutor(max_workers=1) as fetcher, \
+                ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY) as reviewers:
+            # The files list is fetched while the diff streams in
+            files_future = fetcher.submit(self.github_client.get_pr_files, pr_number)
+            sections = self._reviewable_sections(self.github_client.iter_diff_files(pr_number), files_future)
+            
+            # Each group of files is sent for review as soon as its part of the diff has arrived
+            review_futures = [
+                reviewers.submit(self.llm.invoke, self._create_review_prompt(chunk))
+                for chunk in self._chunk_diff_sections(sections)
+            ]
+            files = files_future.result()
+            print(f"Getting AI review ({len(review_futures)} request(s))...")
+            
+            # Parse AI reviews and merge results in chunk order
+            results = []
+            for review_future in review_futures:
+                results.extend(self._parse_ai_review(review_future.result(), files))
         
         return results
     
+    def _reviewable_sections(self, sections: Iterable[str], files_future: "Future[List[Dict[str, Any]]]") -> Iterator[str]:
+        """Yield the diff sections of files the LLM can usefully review, checked once the files list arrives"""
+        skipped = None
+        for section in sections:
+            if skipped is None:
+                files = files_future.result()
+                print(f"Found {len(files)} changed files")
+                skipped = {f["filename"] for f in files if self._should_skip_file(f)}
+                if skipped:
+                    print(f"Skipping {len(skipped)} binary, generated or oversized files")
+            if diff_section_path(section) not in skipped:
+                yield section
+    
+    def _chunk_diff_sections(self, sections: Iterable[str]) -> Iterator[str]:
+        """Group per-file diff sections into chunks of at most MAX_DIFF_CHUNK_CHARS as they arrive"""
+        current = []
+        current_size = 0
+        for section in sections:
+            # A single oversized file still gets its own chunk
+            if current and current_size + len(section) > MAX_DIFF_CHUNK_CHARS:
+                yield "".join(current)
+                current = []
+                current_size = 0
+            current.append(section)
+            current_size += len(section)
+        if current:
+            yield "".join(current)
+    
+    def _should_skip_file(self, file_info: Dict[str, Any]) -> bool:
+        """Check whether a changed file should be left out of the AI review"""
+        filename = file_info["filename"]
+        if file_info.get("status") == "removed":
+            return True
+        # GitHub omits the patch for binary files and very large diffs
+        if "patch" not in file_info:
+            return True
+        if filename.endswith(SKIPPED_FILE_SUFFIXES) or os.path.basename(filename) in SKIPPED_FILE_NAMES:
+            return True
+        return file_info.get("changes", 0) > MAX_FILE_CHANGES
+    
     def _parse_ai_review(self, ai_review: str, files: List[Dict[str, Any]]) -> List[CodeReviewResult]:
         """Parse AI review response into structured results"""
         results = []
-        
-        # Simple parsing - in a real implementation, you'd want more sophisticated parsing
-        lines = ai_review.split('\n')
         current_file = None
+        issue = None
         
-        for line in lines:
-            if line.startswith('**File**:'):
-                current_file = line.split('**File**:')[1].strip()
-            elif line.startswith('- **Line**:'):
-                line_num = int(line.split('**Line**:')[1].strip())
-                # Extract issue details from subsequent lines
-                issue_line = lines[lines.index(line) + 1] if lines.index(line) + 1 < len(lines) else ""
-                suggestion_line = lines[lines.index(line) + 2] if lines.index(line) + 2 < len(lines) else ""
-                
-                result = CodeReviewResult(
-                    file_path=current_file or "unknown",
-                    line_number=line_num,
-                    rule_name="ai_review",
-                    severity="info",
-                    message=issue_line.replace('- **Issue**:', '').strip(),
-                    suggestion=suggestion_line.replace('- **Suggestion**:', '').strip()
-                )
-                results.append(result)
+        for line in ai_review.split('\n'):
+            match = REVIEW_LINE_RE.match(line)
+            if not match:
+                continue
+            
+            field_name = match.lastgroup
+            value = match.group(field_name)
+            if field_name == 'file':
+                current_file = value
+            elif field_name == 'line':
+                # A new line entry closes the previous issue
+                if issue:
+                    results.append(CodeReviewResult(**issue))
+                issue = {
+                    'file_path': current_file or "unknown",
+                    'line_number': int(value),
+                    'rule_name': "ai_review",
+                    'severity': "info",
+                    'message': "",
+                    'suggestion': ""
+                }
+            elif issue:
+                issue['message' if field_name == 'issue' else 'suggestion'] = value
+        
+        if issue:
+            results.append(CodeReviewResult(**issue))
         
         return results
     
+    def _render_section(self, parts: List[str], title: str, items: List[CodeReviewResult]) -> None:
+        """Append one severity section of the review comment to parts"""
+        parts.append(f"## {title}\n")
+        for result in items:
+            parts.append(f"- **{result.file_path}:{result.line_number}** - {result.message}\n")
+            if result.suggestion:
+                parts.append(f"  💡 *Suggestion*: {result.suggestion}\n")
+    
     def post_review_comments(self, pr_number: int, results: List[CodeReviewResult]) -> None:
         """Post review comments to the pull request"""
         if not results:
             comment = "✅ **AI Code Review Complete**\n\nNo issues found! Great work!"
         else:
-            comment = "🤖 **AI Code Review Results**\n\n"
-            
-            # Group results by severity
-            errors = [r for r in results if r.severity == "error"]
-            warnings = [r for r in results if r.severity == "warning"]
-            infos = [r for r in results if r.severity == "info"]
+            parts = ["🤖 **AI Code Review Results**\n\n"]
             
-            if errors:
-                comment += "## ❌ Errors Found\n"
-                for result in errors:
-                    comment += f"- **{result.file_path}:{result.line_number}** - {result.message}\n"
-                    if result.suggestion:
-                        comment += f"  💡 *Suggestion*: {result.suggestion}\n"
-                comment += "\n"
+            # Group results by severity in a single pass
+            buckets = defaultdict(list)
+            for result in results:
+                buckets[result.severity].append(result)
             
-            if warnings:
-                comment += "## ⚠️ Warnings\n"
-                for result in warnings:
-                    comment += f"- **{result.file_path}:{result.line_number}** - {result.message}\n"
-                    if result.suggestion:
-                        comment += f"  💡 *Suggestion*: {result.suggestion}\n"
-                comment += "\n"
+            for severity, title in SEVERITY_SECTIONS:
+                if buckets[severity]:
+                    self._render_section(parts, title, buckets[severity])
+                    parts.append("\n")
             
-            if infos:
-                comment += "## ℹ️ Suggestions\n"
-                for result in infos:
-                    comment += f"- **{result.file_path}:{result.line_number}** - {result.message}\n"
-                    if result.suggestion:
-                        comment += f"  💡 *Suggestion*: {result.suggestion}\n"
+            comment = "".join(parts)
         
         self.github_client.post_comment(pr_number, comment)
         print(f"Posted review comment to PR #{pr_number}")
@@ -293,6 +503,10 @@ def main():
     
     args = parser.parse_args()
     
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+    
     # Check environment variables
     required_vars = ["GITHUB_TOKEN", "GOOGLE_API_KEY", "REPO_OWNER", "REPO_NAME"]
     missing_vars = [var for var in required_vars if not os.getenv(var)]
@@ -323,8 +537,9 @@ def main():
         print(f"✅ Code review completed for PR #{args.pr_number}")
         print(f"Found {len(results)} issues")
         
-    except Exception as e:
-        print(f"❌ Error during code review: {e}")
+    except requests.RequestException as e:
+        # Transient failures were already retried; this one is final
+        print(f"❌ GitHub API error during code review: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
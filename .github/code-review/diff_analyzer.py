@@ -6,13 +6,28 @@ This module provides sophisticated analysis of code differences,
 including syntax highlighting, change categorization, and impact assessment.
 """
 
+import os
 import re
+import sys
 import ast
 import json
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Iterable, Iterator, Union
 from dataclasses import dataclass
 from enum import Enum
 import difflib
+from collections import defaultdict
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+# Diffs touching fewer files than this are analyzed serially; worker startup
+# costs more than the regex work it would spread out
+PARALLEL_MIN_FILES = 32
+
+# Files handed to each worker process per task
+PARALLEL_CHUNK_SIZE = 8
+
+# Unified diff hunk header: @@ -start,count +start,count @@
+HUNK_HEADER_RE = re.compile(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
 
 class ChangeType(Enum):
     """Types of code changes"""
@@ -28,7 +43,7 @@ class ChangeImpact(Enum):
     HIGH = "high"
     CRITICAL = "critical"
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class CodeChange:
     """Represents a single code change"""
     file_path: str
@@ -40,7 +55,7 @@ class CodeChange:
     context: str
     language: str
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class FileAnalysis:
     """Analysis results for a single file"""
     file_path: str
@@ -52,13 +67,47 @@ class FileAnalysis:
     risk_factors: List[str]
     suggestions: List[str]
 
+# Analyzer shared by every task run in a worker process
+_worker_analyzer = None
+
+def _init_worker(analyzer: 'DiffAnalyzer') -> None:
+    """Keep one unpickled analyzer per worker process"""
+    global _worker_analyzer
+    _worker_analyzer = analyzer
+
+def _analyze_file_in_worker(file_info: Dict[str, Any]) -> 'FileAnalysis':
+    """Analyze one parsed file with the worker's analyzer"""
+    return _worker_analyzer._analyze_file(file_info)
+
 class DiffAnalyzer:
     """Advanced diff analyzer for code review"""
     
     def __init__(self):
         self.language_patterns = self._init_language_patterns()
+        # Flat extension lookup; earlier languages win on a shared extension
+        self._extension_languages = {
+            ext: lang
+            for lang, patterns in reversed(list(self.language_patterns.items()))
+            for ext in patterns['extensions']
+        }
         self.risk_patterns = self._init_risk_patterns()
         self.complexity_keywords = self._init_complexity_keywords()
+        self.impact_patterns = self._init_impact_patterns()
+        
+        # Compile every pattern once; matching happens per changed line
+        self._risk_regexes = self._compile_risk_patterns(self.risk_patterns)
+        self._risk_prefilter = self._compile_alternation(
+            [pattern for patterns in self.risk_patterns.values() for pattern in patterns]
+        )
+        self._impact_regexes = [
+            (impact, self._compile_alternation(patterns))
+            for impact, patterns in self.impact_patterns
+        ]
+        # One buffer scan finds every line worth a risk or impact check
+        self._scan_prefilter = self._compile_alternation(
+            [pattern for patterns in self.risk_patterns.values() for pattern in patterns] +
+            [pattern for _, patterns in self.impact_patterns for pattern in patterns]
+        )
     
     def _init_language_patterns(self) -> Dict[str, Dict[str, str]]:
         """Initialize language detection patterns"""
@@ -148,6 +197,42 @@ class DiffAnalyzer:
             ]
         }
     
+    def _init_impact_patterns(self) -> List[Tuple[ChangeImpact, List[str]]]:
+        """Initialize impact assessment patterns, highest impact first"""
+        return [
+            (ChangeImpact.CRITICAL, [
+                r'password', r'secret', r'api_key', r'private_key',
+                r'eval\s*\(', r'exec\s*\(', r'system\s*\(',
+                r'SELECT.*\+', r'INSERT.*\+', r'UPDATE.*\+', r'DELETE.*\+'
+            ]),
+            (ChangeImpact.HIGH, [
+                r'for.*for', r'while.*true', r'sleep\s*\(',
+                r'Thread\.sleep', r'time\.sleep'
+            ]),
+            (ChangeImpact.MEDIUM, [
+                r'TODO', r'FIXME', r'XXX', r'HACK',
+                r'print\s*\(', r'console\.log'
+            ])
+        ]
+    
+    def _lower_pattern(self, pattern: str) -> str:
+        """Lowercase pattern literals, leaving escape sequences such as \\S intact"""
+        return re.sub(r'\\.|[^\\]+', lambda m: m.group(0) if m.group(0)[0] == '\\' else m.group(0).lower(), pattern)
+    
+    def _compile_alternation(self, patterns: List[str]) -> re.Pattern:
+        """Compile patterns into a single alternation matched against lowercased content"""
+        return re.compile("|".join(f"(?:{self._lower_pattern(pattern)})" for pattern in patterns))
+    
+    def _compile_risk_patterns(self, risk_patterns: Dict[str, List[str]]) -> Dict[str, Tuple[re.Pattern, List[Tuple[str, re.Pattern]]]]:
+        """Compile each risk bucket into a combined prefilter plus per-pattern regexes"""
+        return {
+            risk_type: (
+                self._compile_alternation(patterns),
+                [(pattern, re.compile(self._lower_pattern(pattern))) for pattern in patterns]
+            )
+            for risk_type, patterns in risk_patterns.items()
+        }
+    
     def _init_complexity_keywords(self) -> List[str]:
         """Initialize complexity assessment keywords"""
         return [
@@ -159,17 +244,22 @@ class DiffAnalyzer:
     def detect_language(self, file_path: str, content: str = "") -> str:
         """Detect programming language from file path and content"""
         # First, try to detect from file extension
-        for lang, patterns in self.language_patterns.items():
-            for ext in patterns['extensions']:
-                if file_path.endswith(ext):
-                    return lang
+        _, dot, suffix = file_path.rpartition('.')
+        if dot:
+            lang = self._extension_languages.get(dot + suffix)
+            if lang:
+                return lang
         
         # If no extension match, try to detect from content
         if content:
+            # Keywords shared between languages are searched for only once
+            keyword_found = {}
             for lang, patterns in self.language_patterns.items():
                 keyword_count = 0
                 for keyword in patterns['keywords']:
-                    if keyword in content:
+                    if keyword not in keyword_found:
+                        keyword_found[keyword] = keyword in content
+                    if keyword_found[keyword]:
                         keyword_count += 1
                 
                 if keyword_count >= 2:  # At least 2 keywords match
@@ -177,33 +267,58 @@ class DiffAnalyzer:
         
         return 'unknown'
     
-    def analyze_diff(self, diff_text: str) -> List[FileAnalysis]:
+    def analyze_diff(self, diff_text: Union[str, Iterable[str]]) -> List[FileAnalysis]:
         """Analyze a unified diff and return structured analysis"""
-        files = self._parse_diff(diff_text)
-        analyses = []
-        
-        for file_info in files:
-            analysis = self._analyze_file(file_info)
-            analyses.append(analysis)
-        
-        return analyses
+        files = list(self._parse_diff(diff_text))
+        workers = os.cpu_count() or 1
+        if workers < 2 or len(files) < PARALLEL_MIN_FILES:
+            return [self._analyze_file(file_info) for file_info in files]
+        
+        # File analyses are independent and CPU-bound, so spread them across processes
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self,)) as executor:
+            return list(executor.map(_analyze_file_in_worker, files, chunksize=PARALLEL_CHUNK_SIZE))
+    
+    def iter_analyze_diff(self, diff_text: Union[str, Iterable[str]]) -> Iterator[FileAnalysis]:
+        """Analyze a unified diff, yielding each file's analysis as soon as it is parsed"""
+        # diff_text may also be an open file or a subprocess stdout pipe,
+        # so a large diff never has to be held in memory as a whole
+        for file_info in self._parse_diff(diff_text):
+            yield self._analyze_file(file_info)
     
-    def _parse_diff(self, diff_text: str) -> List[Dict[str, Any]]:
-        """Parse unified diff into structured format"""
-        files = []
+    def _parse_diff(self, diff_text: Union[str, Iterable[str]]) -> Iterator[Dict[str, Any]]:
+        """Parse unified diff into structured format, one file at a time"""
         current_file = None
         current_hunk = None
+        hunk_starts = {}
+        change_types = {'+': ChangeType.ADDITION, '-': ChangeType.DELETION}
         
-        lines = diff_text.split('\n')
-        i = 0
+        if isinstance(diff_text, str):
+            lines = diff_text.split('\n')
+        else:
+            lines = (line.rstrip('\n') for line in diff_text)
         
-        while i < len(lines):
-            line = lines[i]
+        for line in lines:
+            # Dispatch on the first character once instead of testing every prefix
+            prefix = line[:1]
+            
+            if prefix == '+' or prefix == '-':
+                # File paths
+                if line.startswith('+++') or line.startswith('---'):
+                    if current_file:
+                        current_file['new_path' if prefix == '+' else 'old_path'] = line[4:].strip()
+                
+                # Content lines
+                elif current_file and current_hunk:
+                    current_file['changes'].append({
+                        'type': change_types[prefix],
+                        'content': line[1:],
+                        'line_number': hunk_starts[prefix]
+                    })
             
             # File header
-            if line.startswith('diff --git'):
+            elif prefix == 'd' and line.startswith('diff --git'):
                 if current_file:
-                    files.append(current_file)
+                    yield current_file
                 
                 current_file = {
                     'file_path': self._extract_file_path(line),
@@ -213,30 +328,15 @@ class DiffAnalyzer:
                     'new_content': ''
                 }
             
-            # File paths
-            elif line.startswith('---') or line.startswith('+++'):
-                if current_file:
-                    if line.startswith('---'):
-                        current_file['old_path'] = line[4:].strip()
-                    else:
-                        current_file['new_path'] = line[4:].strip()
-            
             # Hunk header
-            elif line.startswith('@@'):
+            elif prefix == '@' and line.startswith('@@'):
                 current_hunk = self._parse_hunk_header(line)
+                hunk_starts = {'+': current_hunk.get('new_start', 0), '-': current_hunk.get('old_start', 0)}
             
-            # Content lines
-            elif line.startswith(('+', '-', ' ')) and current_file and current_hunk:
-                change = self._parse_content_line(line, current_hunk)
-                if change:
-                    current_file['changes'].append(change)
-            
-            i += 1
+            # Context lines (' ') carry no change
         
         if current_file:
-            files.append(current_file)
-        
-        return files
+            yield current_file
     
     def _extract_file_path(self, diff_line: str) -> str:
         """Extract file path from diff header"""
@@ -249,7 +349,7 @@ class DiffAnalyzer:
     def _parse_hunk_header(self, header: str) -> Dict[str, int]:
         """Parse hunk header to get line numbers"""
         # Format: @@ -start,count +start,count @@
-        match = re.search(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@', header)
+        match = HUNK_HEADER_RE.search(header)
         if match:
             return {
                 'old_start': int(match.group(1)),
@@ -259,61 +359,53 @@ class DiffAnalyzer:
             }
         return {}
     
-    def _parse_content_line(self, line: str, hunk: Dict[str, int]) -> Optional[Dict[str, Any]]:
-        """Parse a content line and return change information"""
-        if len(line) < 1:
-            return None
-        
-        prefix = line[0]
-        content = line[1:]
-        
-        change_type = None
-        if prefix == '+':
-            change_type = ChangeType.ADDITION
-        elif prefix == '-':
-            change_type = ChangeType.DELETION
-        elif prefix == ' ':
-            return None  # Context line
-        
-        return {
-            'type': change_type,
-            'content': content,
-            'line_number': hunk.get('new_start', 0) if prefix == '+' else hunk.get('old_start', 0)
-        }
-    
     def _analyze_file(self, file_info: Dict[str, Any]) -> FileAnalysis:
         """Analyze a single file's changes"""
-        file_path = file_info['file_path']
+        # Every CodeChange of the file shares this one path object
+        file_path = sys.intern(file_info['file_path'])
         changes = file_info['changes']
         
         # Detect language
         language = self.detect_language(file_path)
         
-        # Count additions and deletions
-        additions = sum(1 for change in changes if change['type'] == ChangeType.ADDITION)
-        deletions = sum(1 for change in changes if change['type'] == ChangeType.DELETION)
+        # Count additions and deletions in a single pass
+        additions = 0
+        deletions = 0
+        for change in changes:
+            change_type = change['type']
+            if change_type is ChangeType.ADDITION:
+                additions += 1
+            elif change_type is ChangeType.DELETION:
+                deletions += 1
         
         # Analyze complexity change
         complexity_change = self._analyze_complexity_change(changes)
         
-        # Identify risk factors
-        risk_factors = self._identify_risk_factors(changes, language)
+        # Scan all changed lines in one buffer to find the few that match anything
+        buffer, line_starts = self._join_change_contents(changes)
+        candidate_lines = self._matching_line_indices(self._scan_prefilter, buffer, line_starts)
+        
+        # Identify risk factors and per-line impact in the same pass
+        risk_factors, impacts = self._identify_risk_factors([changes[i] for i in candidate_lines], language)
+        line_impacts = dict(zip(candidate_lines, impacts))
         
         # Generate suggestions
         suggestions = self._generate_suggestions(changes, language, risk_factors)
         
         # Create CodeChange objects
+        contexts = self._build_contexts(changes)
         code_changes = []
-        for change in changes:
-            impact = self._assess_change_impact(change, risk_factors)
+        for i, change in enumerate(changes):
+            impact = line_impacts.get(i, ChangeImpact.LOW)
+            is_addition = change['type'] is ChangeType.ADDITION
             code_change = CodeChange(
                 file_path=file_path,
                 line_number=change['line_number'],
                 change_type=change['type'],
-                old_content='' if change['type'] == ChangeType.ADDITION else change['content'],
-                new_content=change['content'] if change['type'] == ChangeType.ADDITION else '',
+                old_content='' if is_addition else change['content'],
+                new_content=change['content'] if is_addition else '',
                 impact=impact,
-                context=self._get_context(changes, change),
+                context=contexts[i],
                 language=language
             )
             code_changes.append(code_change)
@@ -329,6 +421,35 @@ class DiffAnalyzer:
             suggestions=suggestions
         )
     
+    def _join_change_contents(self, changes: List[Dict[str, Any]]) -> Tuple[str, List[int]]:
+        """Join lowercased change contents into one newline-separated buffer with line start offsets"""
+        # Lowercasing can change a line's length, so offsets come from the lowered text
+        lowered = [change['content'].lower() for change in changes]
+        line_starts = []
+        offset = 0
+        for content in lowered:
+            line_starts.append(offset)
+            offset += len(content) + 1
+        return '\n'.join(lowered), line_starts
+    
+    def _matching_line_indices(self, regex: re.Pattern, buffer: str, line_starts: List[int]) -> List[int]:
+        """Return indices of lines that may match regex, using one C-level scan of the buffer"""
+        # A match inside a line is also a match in the buffer at the same offset, so no
+        # matching line is skipped; matches spanning lines only add candidates, which
+        # callers re-check line by line.
+        indices = []
+        pos = 0
+        while True:
+            match = regex.search(buffer, pos)
+            if not match:
+                break
+            index = bisect_right(line_starts, match.start()) - 1
+            indices.append(index)
+            if index + 1 >= len(line_starts):
+                break
+            pos = line_starts[index + 1]
+        return indices
+    
     def _analyze_complexity_change(self, changes: List[Dict[str, Any]]) -> int:
         """Analyze how changes affect code complexity"""
         complexity_delta = 0
@@ -339,26 +460,35 @@ class DiffAnalyzer:
             # Count complexity keywords
             keyword_count = sum(1 for keyword in self.complexity_keywords if keyword in content)
             
-            if change['type'] == ChangeType.ADDITION:
+            if change['type'] is ChangeType.ADDITION:
                 complexity_delta += keyword_count
-            elif change['type'] == ChangeType.DELETION:
+            elif change['type'] is ChangeType.DELETION:
                 complexity_delta -= keyword_count
         
         return complexity_delta
     
-    def _identify_risk_factors(self, changes: List[Dict[str, Any]], language: str) -> List[str]:
-        """Identify potential risk factors in changes"""
-        risk_factors = []
+    def _identify_risk_factors(self, changes: List[Dict[str, Any]], language: str) -> Tuple[List[str], List[ChangeImpact]]:
+        """Identify potential risk factors in changes, along with each change's impact"""
+        risk_factors = set()
+        impacts = []
         
         for change in changes:
-            content = change['content']
+            content = change['content'].lower()
+            impacts.append(self._assess_change_impact(content))
             
-            for risk_type, patterns in self.risk_patterns.items():
-                for pattern in patterns:
-                    if re.search(pattern, content, re.IGNORECASE):
-                        risk_factors.append(f"{risk_type}: {pattern}")
-        
-        return list(set(risk_factors))  # Remove duplicates
+            # Lines matching no risk pattern at all need only this one scan
+            if not self._risk_prefilter.search(content):
+                continue
+            
+            for risk_type, (combined, patterns) in self._risk_regexes.items():
+                # One combined search rules out the whole bucket for most lines
+                if not combined.search(content):
+                    continue
+                for pattern, regex in patterns:
+                    if regex.search(content):
+                        risk_factors.add(f"{risk_type}: {pattern}")
+        
+        return list(risk_factors), impacts
     
     def _generate_suggestions(self, changes: List[Dict[str, Any]], language: str, risk_factors: List[str]) -> List[str]:
         """Generate improvement suggestions based on changes"""
@@ -431,54 +561,37 @@ class DiffAnalyzer:
         
         return suggestions
     
-    def _assess_change_impact(self, change: Dict[str, Any], risk_factors: List[str]) -> ChangeImpact:
-        """Assess the impact level of a change"""
-        content = change['content']
-        
-        # Check for critical patterns
-        critical_patterns = [
-            r'password', r'secret', r'api_key', r'private_key',
-            r'eval\s*\(', r'exec\s*\(', r'system\s*\(',
-            r'SELECT.*\+', r'INSERT.*\+', r'UPDATE.*\+', r'DELETE.*\+'
-        ]
-        
-        for pattern in critical_patterns:
-            if re.search(pattern, content, re.IGNORECASE):
-                return ChangeImpact.CRITICAL
-        
-        # Check for high impact patterns
-        high_patterns = [
-            r'for.*for', r'while.*true', r'sleep\s*\(',
-            r'Thread\.sleep', r'time\.sleep'
-        ]
-        
-        for pattern in high_patterns:
-            if re.search(pattern, content, re.IGNORECASE):
-                return ChangeImpact.HIGH
-        
-        # Check for medium impact patterns
-        medium_patterns = [
-            r'TODO', r'FIXME', r'XXX', r'HACK',
-            r'print\s*\(', r'console\.log'
-        ]
-        
-        for pattern in medium_patterns:
-            if re.search(pattern, content, re.IGNORECASE):
-                return ChangeImpact.MEDIUM
+    def _assess_change_impact(self, content: str) -> ChangeImpact:
+        """Assess the impact level of a lowercased changed line"""
+        # Check critical, then high, then medium impact patterns
+        for impact, regex in self._impact_regexes:
+            if regex.search(content):
+                return impact
         
         return ChangeImpact.LOW
     
-    def _get_context(self, changes: List[Dict[str, Any]], current_change: Dict[str, Any]) -> str:
-        """Get context around a change"""
+    def _build_contexts(self, changes: List[Dict[str, Any]]) -> List[str]:
+        """Get context around each change: all changes within 3 lines of it"""
         # Simple context extraction - in a real implementation,
         # you'd want to get more surrounding lines
-        context_lines = []
-        
-        for change in changes:
-            if abs(change['line_number'] - current_change['line_number']) <= 3:
-                context_lines.append(change['content'])
-        
-        return '\n'.join(context_lines)
+        by_line = defaultdict(list)
+        for i, change in enumerate(changes):
+            by_line[change['line_number']].append(i)
+        
+        # Changes sharing a line number share a context, so slide a window
+        # over the sorted distinct line numbers and build each context once
+        line_numbers = sorted(by_line)
+        context_by_line = {}
+        lo = hi = 0
+        for line_number in line_numbers:
+            while line_numbers[lo] < line_number - 3:
+                lo += 1
+            while hi < len(line_numbers) and line_numbers[hi] <= line_number + 3:
+                hi += 1
+            window = sorted(i for n in line_numbers[lo:hi] for i in by_line[n])
+            context_by_line[line_number] = '\n'.join(changes[i]['content'] for i in window)
+        
+        return [context_by_line[change['line_number']] for change in changes]
     
     def generate_summary(self, analyses: List[FileAnalysis]) -> Dict[str, Any]:
         """Generate a summary of all file analyses"""
@@ -494,15 +607,16 @@ class DiffAnalyzer:
             ChangeImpact.LOW: 0
         }
         
-        all_risk_factors = []
-        all_suggestions = []
+        # Sets deduplicate as they accumulate
+        all_risk_factors = set()
+        all_suggestions = set()
         
         for analysis in analyses:
             for change in analysis.changes:
                 impact_counts[change.impact] += 1
             
-            all_risk_factors.extend(analysis.risk_factors)
-            all_suggestions.extend(analysis.suggestions)
+            all_risk_factors.update(analysis.risk_factors)
+            all_suggestions.update(analysis.suggestions)
         
         return {
             'summary': {
@@ -517,8 +631,8 @@ class DiffAnalyzer:
                 'medium': impact_counts[ChangeImpact.MEDIUM],
                 'low': impact_counts[ChangeImpact.LOW]
             },
-            'risk_factors': list(set(all_risk_factors)),
-            'suggestions': list(set(all_suggestions)),
+            'risk_factors': list(all_risk_factors),
+            'suggestions': list(all_suggestions),
             'files': [
                 {
                     'path': analysis.file_path,
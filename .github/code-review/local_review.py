@@ -15,19 +15,134 @@ Examples:
     python local_review.py main --format json
 """
 
+import io
 import os
+import re
 import sys
 import json
+import asyncio
 import argparse
+import hashlib
+import shelve
+import dbm
 import subprocess
-from typing import List, Dict, Any, Optional
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple, Union
 from dataclasses import dataclass
+from functools import cached_property
+from collections import defaultdict
 from datetime import datetime
 
 # Import our existing modules
 from diff_analyzer import DiffAnalyzer
-from review_prompts import ReviewPromptManager
-from code_review_bot import CodeReviewBot
+from review_prompts import get_manager
+from code_review_bot import CodeReviewBot, diff_section_path
+
+# Paths passed to a single git diff call, keeping command lines well under OS limits
+DIFF_PATHSPEC_BATCH = 200
+
+# Threads reading changed files from the working tree
+FILE_READ_WORKERS = 16
+
+# Leading bytes checked for NUL to recognise binary files before decoding them
+BINARY_SNIFF_BYTES = 512
+
+# Generous bytes per line; only the first max_lines_per_file of these are read from a file
+MAX_BYTES_PER_LINE = 200
+
+# Persistent per-file regex rule results, reused while a file and the rules are unchanged
+RULES_CACHE_PATH = ".github/code-review/.cache/rules"
+
+# Cache key holding the rules version; NUL cannot appear in a path
+RULES_VERSION_KEY = "\0rules_version"
+
+# Specialized prompt responses, reused while a file's diff and the prompt are unchanged
+PROMPT_RESPONSE_CACHE_PATH = ".github/code-review/.cache/responses"
+
+# Environment variable that, when set to batch, writes a batch job file instead of reviewing
+REVIEW_MODE_ENV = "REVIEW_MODE"
+
+# Start of each per-file section in a git diff
+DIFF_SECTION_START_RE = re.compile(r"^(?=diff --git )", re.MULTILINE)
+
+# File extensions of each language that can be listed in focus_languages
+LANGUAGE_EXTENSIONS = {
+    'python': ['.py'],
+    'javascript': ['.js', '.jsx'],
+    'typescript': ['.ts', '.tsx'],
+    'java': ['.java'],
+    'cpp': ['.cpp', '.cc', '.cxx', '.hpp', '.h'],
+    'c': ['.c'],
+    'go': ['.go'],
+    'rust': ['.rs']
+}
+
+# Diff characters sent with a local AI review; the rest is cut to bound request size
+MAX_REVIEW_DIFF_CHARS = 400000
+
+# Review prompt text before the list of changed files
+AI_REVIEW_PROMPT_HEADER = """
+You are an expert code reviewer conducting a comprehensive review of the following changes.
+
+FILES CHANGED:
+"""
+
+# Review instructions after the code changes; {files_count} is filled in per review
+AI_REVIEW_PROMPT_TRAILER = """
+
+Please provide a detailed code review focusing on:
+
+1. **Security Analysis**
+   - Authentication and authorization issues
+   - Input validation problems
+   - Data protection concerns
+   - SQL injection vulnerabilities
+   - XSS and other web vulnerabilities
+
+2. **Performance Issues**
+   - Algorithm efficiency
+   - Memory usage
+   - Database query optimization
+   - Network operations
+   - Caching opportunities
+
+3. **Code Quality**
+   - Code structure and organization
+   - Readability and maintainability
+   - Error handling
+   - Testing coverage
+   - Documentation
+
+4. **Best Practices**
+   - Language-specific best practices
+   - Design patterns
+   - Code standards compliance
+   - Technical debt
+
+Format your response as:
+
+## 🔍 Code Review Summary
+[Overall assessment of the changes]
+
+## 🚨 Critical Issues
+- **File**: [filename]
+  - **Line**: [line number]
+  - **Issue**: [specific problem]
+  - **Risk**: [explanation of risk]
+  - **Fix**: [specific solution]
+
+## ⚠️ Warnings
+[High and medium priority issues]
+
+## 💡 Recommendations
+[General improvement suggestions]
+
+## 📊 Metrics
+- Files changed: {files_count}
+- Estimated complexity change: [assessment]
+- Risk level: [Low/Medium/High/Critical]
+"""
 
 @dataclass
 class ReviewReport:
@@ -49,7 +164,13 @@ class LocalCodeReviewer:
     def __init__(self, config_path: str = ".github/code-review/config.json"):
         self.config_path = config_path
         self.diff_analyzer = DiffAnalyzer()
-        self.prompt_manager = ReviewPromptManager()
+        self.prompt_manager = get_manager(PROMPT_RESPONSE_CACHE_PATH)
+        # Long-running `git cat-file --batch` process, started on first use
+        self._cat_file_process = None
+        # git output memoized by argument tuple until invalidate()
+        self._git_cache = {}
+        # Regex rule result cache, opened on first use
+        self._rules_cache = None
         self.load_config()
     
     def load_config(self):
@@ -72,124 +193,150 @@ class LocalCodeReviewer:
                     "focus_languages": ["python", "javascript", "typescript", "java", "cpp", "c", "go", "rust"]
                 }
             }
+        self._compile_rules()
+        self._prepare_file_filters()
+    
+    def _compile_rules(self):
+        """Compile regex rules once: a multiline form to scan whole files, and the per-line form to confirm hits"""
+        self._regex_rules = [
+            (
+                index,
+                rule,
+                re.compile(rule['pattern'], re.IGNORECASE | re.MULTILINE),
+                re.compile(rule['pattern'], re.IGNORECASE)
+            )
+            for index, rule in enumerate(self.config.get("rules", []))
+            if rule.get('type', 'regex') == 'regex'
+        ]
+        # Cached results only hold for the rules and line limit they were computed with
+        rules_settings = {
+            "rules": [(index, rule) for index, rule, _, _ in self._regex_rules],
+            "max_lines_per_file": self.config.get("review_settings", {}).get("max_lines_per_file")
+        }
+        self._rules_version = hashlib.blake2b(
+            json.dumps(rules_settings, sort_keys=True).encode("utf-8"), digest_size=16
+        ).hexdigest()
     
     def get_current_branch(self) -> str:
         """Get the current git branch name"""
         try:
-            result = subprocess.run(
-                ["git", "rev-parse", "--abbrev-ref", "HEAD"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            return result.stdout.strip()
+            return self._run_git("rev-parse", "--abbrev-ref", "HEAD").strip()
         except subprocess.CalledProcessError:
             return "unknown"
     
-    def get_diff(self, base_branch: str, current_branch: str, include_uncommitted: bool = True) -> str:
-        """Get the diff between two branches, optionally including uncommitted changes"""
+    def get_diff(self, base_branch: str, current_branch: str, include_uncommitted: bool = True, files: Optional[List[str]] = None) -> str:
+        """Get the diff between two branches, optionally including uncommitted changes and limited to files"""
+        return "".join(self.iter_diff_lines(base_branch, current_branch, include_uncommitted, files))
+    
+    def iter_diff_lines(self, base_branch: str, current_branch: str, include_uncommitted: bool = True, files: Optional[List[str]] = None) -> Iterator[str]:
+        """Stream the diff between two branches line by line, so a large diff is never held in memory whole"""
+        if not include_uncommitted:
+            # Only committed changes
+            try:
+                for command in self._diff_commands([f"{base_branch}...{current_branch}"], files):
+                    yield from self._stream_git(*command)
+            except subprocess.CalledProcessError as e:
+                print(f"Error getting diff: {e}")
+            return
+        
+        sections = (
+            self._stream_diff([f"{base_branch}...{current_branch}"], files, ["."]),
+            self._stream_diff(["--cached"], files),
+            self._stream_diff([], files),
+            self._stream_untracked_diff(files)
+        )
+        # Non-empty sections are separated by a blank line
+        emitted = False
+        for section in sections:
+            started = False
+            for line in section:
+                if not started:
+                    if emitted:
+                        yield "\n"
+                    started = emitted = True
+                yield line
+    
+    def _stream_diff(self, args: List[str], files: Optional[List[str]], default_paths: Optional[List[str]] = None) -> Iterator[str]:
+        """Stream one git diff section, yielding nothing if git fails"""
         try:
-            if include_uncommitted:
-                diff_parts = []
-                
-                # 1. Get committed changes between branches
-                try:
-                    result = subprocess.run(
-                        ["git", "diff", f"{base_branch}...{current_branch}", "--", "."],
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                    if result.stdout.strip():
-                        diff_parts.append(result.stdout)
-                except subprocess.CalledProcessError:
-                    pass
-                
-                # 2. Get staged changes
-                try:
-                    staged_result = subprocess.run(
-                        ["git", "diff", "--cached"],
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                    if staged_result.stdout.strip():
-                        diff_parts.append(staged_result.stdout)
-                except subprocess.CalledProcessError:
-                    pass
-                
-                # 3. Get working directory changes
-                try:
-                    working_result = subprocess.run(
-                        ["git", "diff"],
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                    if working_result.stdout.strip():
-                        diff_parts.append(working_result.stdout)
-                except subprocess.CalledProcessError:
-                    pass
-                
-                # 4. Get untracked files as "new file" diffs
-                try:
-                    untracked_result = subprocess.run(
-                        ["git", "ls-files", "--others", "--exclude-standard"],
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                    untracked_files = untracked_result.stdout.strip().split('\n')
-                    untracked_files = [f for f in untracked_files if f.strip()]
-                    
-                    if untracked_files:
-                        # Create a diff-like representation for untracked files
-                        untracked_diff = ""
-                        for file_path in untracked_files:
-                            try:
-                                # Read the file content
-                                with open(file_path, 'r', encoding='utf-8') as f:
-                                    content = f.read()
-                                
-                                # Create a diff-like format
-                                untracked_diff += f"diff --git a/{file_path} b/{file_path}\n"
-                                untracked_diff += f"new file mode 100644\n"
-                                untracked_diff += f"index 0000000..{hash(content) % 1000000:07x}\n"
-                                untracked_diff += f"--- /dev/null\n"
-                                untracked_diff += f"+++ b/{file_path}\n"
-                                
-                                # Add content with + prefix
-                                for line in content.split('\n'):
-                                    untracked_diff += f"+{line}\n"
-                                untracked_diff += "\n"
-                            except (UnicodeDecodeError, PermissionError, FileNotFoundError):
-                                # Skip binary files or files we can't read
-                                untracked_diff += f"diff --git a/{file_path} b/{file_path}\n"
-                                untracked_diff += f"new file mode 100644\n"
-                                untracked_diff += f"index 0000000..0000000\n"
-                                untracked_diff += f"--- /dev/null\n"
-                                untracked_diff += f"+++ b/{file_path}\n"
-                                untracked_diff += f"+[Binary file or unreadable]\n\n"
-                        
-                        if untracked_diff.strip():
-                            diff_parts.append(untracked_diff)
-                except subprocess.CalledProcessError:
-                    pass
-                
-                # Combine all diff parts
-                return "\n".join(diff_parts) if diff_parts else ""
-            else:
-                # Only committed changes
-                result = subprocess.run(
-                    ["git", "diff", f"{base_branch}...{current_branch}"],
-                    capture_output=True,
-                    text=True,
-                    check=True
-                )
-                return result.stdout
-        except subprocess.CalledProcessError as e:
-            print(f"Error getting diff: {e}")
-            return ""
+            for command in self._diff_commands(args, files, default_paths):
+                yield from self._stream_git(*command)
+        except subprocess.CalledProcessError:
+            pass
+    
+    def _stream_untracked_diff(self, files: Optional[List[str]]) -> Iterator[str]:
+        """Stream synthesized diffs of untracked files, one file in memory at a time"""
+        try:
+            untracked_files = self._select_untracked_files(self._run_git("ls-files", "--others", "--exclude-standard"), files)
+        except subprocess.CalledProcessError:
+            return
+        for file_path in untracked_files:
+            yield from io.StringIO(self._untracked_file_diff(file_path))
+    
+    def _stream_git(self, *args: str) -> Iterator[str]:
+        """Yield a git command's output lines as git writes them, decoded like _run_git"""
+        process = subprocess.Popen(
+            ["git", *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            yield from io.TextIOWrapper(process.stdout, encoding='utf-8', errors='replace')
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, ["git", *args])
+    
+    def _diff_commands(self, args: List[str], files: Optional[List[str]], default_paths: Optional[List[str]] = None) -> Iterator[List[str]]:
+        """Yield the git diff argument lists that cover files, or the whole tree when files is None"""
+        if files is None:
+            pathspecs = ["--", *default_paths] if default_paths else []
+            yield ["diff", *args, *pathspecs]
+            return
+        
+        # Files dropped by filter_files are never diffed; paths are matched literally, not as globs
+        for i in range(0, len(files), DIFF_PATHSPEC_BATCH):
+            yield ["--literal-pathspecs", "diff", *args, "--", *files[i:i + DIFF_PATHSPEC_BATCH]]
+    
+    def _select_untracked_files(self, ls_files_output: str, files: Optional[List[str]]) -> List[str]:
+        """Parse git ls-files output, keeping only the given files when a list is passed"""
+        untracked_files = [f for f in ls_files_output.strip().split('\n') if f.strip()]
+        if files is not None:
+            wanted = set(files)
+            untracked_files = [f for f in untracked_files if f in wanted]
+        return untracked_files
+    
+    def _untracked_file_diff(self, file_path: str) -> str:
+        """Create a diff-like "new file" entry for an untracked file"""
+        try:
+            # Read the raw bytes once: checksum them directly, decode once
+            with open(file_path, 'rb') as f:
+                raw = f.read()
+            content = raw.decode('utf-8')
+            if '\r' in content:
+                # Match text-mode reads, which turn \r\n and \r into \n
+                content = content.replace('\r\n', '\n').replace('\r', '\n')
+            
+            # Add content with + prefix in one C-level replace
+            return (
+                f"diff --git a/{file_path} b/{file_path}\n"
+                f"new file mode 100644\n"
+                f"index 0000000..{zlib.crc32(raw) & 0xFFFFFFF:07x}\n"
+                f"--- /dev/null\n"
+                f"+++ b/{file_path}\n"
+                "+" + content.replace('\n', '\n+') + "\n\n"
+            )
+        except (UnicodeDecodeError, PermissionError, FileNotFoundError):
+            # Skip binary files or files we can't read
+            return (
+                f"diff --git a/{file_path} b/{file_path}\n"
+                f"new file mode 100644\n"
+                f"index 0000000..0000000\n"
+                f"--- /dev/null\n"
+                f"+++ b/{file_path}\n"
+                f"+[Binary file or unreadable]\n\n"
+            )
     
     def get_changed_files(self, base_branch: str, current_branch: str, include_uncommitted: bool = True) -> List[str]:
         """Get list of changed files between branches, optionally including uncommitted changes"""
@@ -199,254 +346,251 @@ class LocalCodeReviewer:
             if include_uncommitted:
                 # Get committed changes
                 try:
-                    result = subprocess.run(
-                        ["git", "diff", "--name-only", f"{base_branch}...{current_branch}"],
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                    committed_files = result.stdout.strip().split('\n')
-                    files.update(f for f in committed_files if f.strip())
-                except subprocess.CalledProcessError:
-                    pass
-                
-                # Get staged changes
-                try:
-                    staged_result = subprocess.run(
-                        ["git", "diff", "--name-only", "--cached"],
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                    staged_files = staged_result.stdout.strip().split('\n')
-                    files.update(f for f in staged_files if f.strip())
-                except subprocess.CalledProcessError:
-                    pass
-                
-                # Get working directory changes
-                try:
-                    working_result = subprocess.run(
-                        ["git", "diff", "--name-only"],
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                    working_files = working_result.stdout.strip().split('\n')
-                    files.update(f for f in working_files if f.strip())
+                    files.update(self._git_paths("diff", "--name-only", f"{base_branch}...{current_branch}"))
                 except subprocess.CalledProcessError:
                     pass
                 
-                # Get untracked files
+                # Get staged, working directory and untracked changes in one call
                 try:
-                    untracked_result = subprocess.run(
-                        ["git", "ls-files", "--others", "--exclude-standard"],
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                    untracked_files = untracked_result.stdout.strip().split('\n')
-                    files.update(f for f in untracked_files if f.strip())
+                    files.update(self._get_uncommitted_files())
                 except subprocess.CalledProcessError:
                     pass
             else:
                 # Only committed changes
-                result = subprocess.run(
-                    ["git", "diff", "--name-only", f"{base_branch}...{current_branch}"],
-                    capture_output=True,
-                    text=True,
-                    check=True
-                )
-                committed_files = result.stdout.strip().split('\n')
-                files.update(f for f in committed_files if f.strip())
+                files.update(self._git_paths("diff", "--name-only", f"{base_branch}...{current_branch}"))
             
             return list(files)
         except subprocess.CalledProcessError:
             return []
     
-    def filter_files(self, files: List[str]) -> List[str]:
-        """Filter files based on configuration"""
+    def _git_paths(self, *args: str) -> List[str]:
+        """Run a git command that lists paths and return them, NUL-separated so any path name survives"""
+        return [path for path in self._run_git(*args, "-z").split('\0') if path]
+    
+    def _run_git(self, *args: str) -> str:
+        """Run a git command and return its output, memoized by arguments until invalidate()"""
+        output = self._git_cache.get(args)
+        if output is None:
+            result = subprocess.run(
+                ["git", *args],
+                capture_output=True,
+                check=True
+            )
+            # Decode in one pass as UTF-8, so a diff touching a non-UTF-8 file cannot
+            # fail the review; newlines are normalized as text mode would
+            output = result.stdout.decode('utf-8', errors='replace')
+            if '\r' in output:
+                output = output.replace('\r\n', '\n').replace('\r', '\n')
+            self._git_cache[args] = output
+        return output
+    
+    def invalidate(self):
+        """Forget memoized git output, e.g. after the repository changed between reviews"""
+        self._git_cache.clear()
+    
+    def _get_uncommitted_files(self) -> List[str]:
+        """Get staged, unstaged and untracked files from a single git status call"""
+        entries = iter(self._git_paths("status", "--porcelain", "--untracked-files=all"))
+        files = []
+        for entry in entries:
+            # Entry format: XY <path>; renames and copies are followed by the original path
+            status, path = entry[:2], entry[3:]
+            files.append(path)
+            if 'R' in status or 'C' in status:
+                next(entries, None)
+        return files
+    
+    def _cat_file(self, object_name: str) -> Optional[bytes]:
+        """Read a blob such as `branch:path` through one long-running git cat-file process"""
+        if self._cat_file_process is None:
+            self._cat_file_process = subprocess.Popen(
+                ["git", "cat-file", "--batch"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE
+            )
+        process = self._cat_file_process
+        process.stdin.write(object_name.encode("utf-8") + b"\n")
+        process.stdin.flush()
+        
+        # Response: <sha> <type> <size>\n<contents>\n, or <object> missing\n
+        header = process.stdout.readline().split()
+        if len(header) != 3:
+            return None
+        _, object_type, size = header
+        contents = process.stdout.read(int(size) + 1)[:-1]
+        return contents if object_type == b"blob" else None
+    
+    def close(self):
+        """Stop the git cat-file process and close the rule cache, if they were opened"""
+        if self._cat_file_process is not None:
+            self._cat_file_process.stdin.close()
+            self._cat_file_process.wait()
+            self._cat_file_process = None
+        if self._rules_cache is not None:
+            self._rules_cache.close()
+            self._rules_cache = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _prepare_file_filters(self):
+        """Precompute the skip and focus lookups used by filter_files"""
         skip_patterns = self.config.get("review_settings", {}).get("skip_files", [])
         focus_languages = self.config.get("review_settings", {}).get("focus_languages", [])
         
+        # "*.ext" patterns match by suffix, anything else by substring
+        self._skip_suffixes = tuple(pattern[1:] for pattern in skip_patterns if pattern.startswith("*."))
+        self._skip_substrings = tuple(pattern for pattern in skip_patterns if not pattern.startswith("*."))
+        
+        # No focus languages means every file is kept
+        self._focus_extensions = frozenset(
+            ext
+            for lang, exts in LANGUAGE_EXTENSIONS.items() if lang in focus_languages
+            for ext in exts
+        ) if focus_languages else None
+    
+    def filter_files(self, files: List[str]) -> List[str]:
+        """Filter files based on configuration"""
         filtered_files = []
         for file in files:
             # Skip files matching skip patterns
-            should_skip = False
-            for pattern in skip_patterns:
-                if pattern.startswith("*."):
-                    ext = pattern[1:]  # Remove the *
-                    if file.endswith(ext):
-                        should_skip = True
-                        break
-                elif pattern in file:
-                    should_skip = True
-                    break
-            
-            if should_skip:
+            if file.endswith(self._skip_suffixes) or any(pattern in file for pattern in self._skip_substrings):
                 continue
             
             # Check if file is in focus languages
-            file_ext = os.path.splitext(file)[1]
-            if focus_languages:
-                language_extensions = {
-                    'python': ['.py'],
-                    'javascript': ['.js', '.jsx'],
-                    'typescript': ['.ts', '.tsx'],
-                    'java': ['.java'],
-                    'cpp': ['.cpp', '.cc', '.cxx', '.hpp', '.h'],
-                    'c': ['.c'],
-                    'go': ['.go'],
-                    'rust': ['.rs']
-                }
-                
-                file_language = None
-                for lang, exts in language_extensions.items():
-                    if file_ext in exts:
-                        file_language = lang
-                        break
-                
-                if file_language and file_language in focus_languages:
-                    filtered_files.append(file)
-            else:
+            if self._focus_extensions is None or os.path.splitext(file)[1] in self._focus_extensions:
                 filtered_files.append(file)
         
         return filtered_files
     
+    @cached_property
+    def llm(self):
+        """LLM client for AI reviews, created on first use and reused afterwards"""
+        # Import Google AI components
+        from langchain_google_genai import GoogleGenerativeAI
+        
+        return GoogleGenerativeAI(
+            model=self.config["ai_settings"]["model"],
+            temperature=self.config["ai_settings"]["temperature"],
+            max_output_tokens=self.config["ai_settings"]["max_tokens"]
+        )
+    
     def generate_ai_review(self, diff: str, files: List[str]) -> str:
         """Generate AI-powered code review"""
         try:
-            # Import Google AI components
-            from langchain_google_genai import GoogleGenerativeAI
-            
-            # Initialize LLM
-            llm = GoogleGenerativeAI(
-                model=self.config["ai_settings"]["model"],
-                temperature=self.config["ai_settings"]["temperature"],
-                max_output_tokens=self.config["ai_settings"]["max_tokens"]
-            )
-            
-            # Get security prompt (highest priority)
-            security_prompt = self.prompt_manager.get_prompt_by_name("security")
-            
             # Create comprehensive review prompt
             files_text = "\n".join([f"- {file}" for file in files])
             
-            prompt = f"""
-You are an expert code reviewer conducting a comprehensive review of the following changes.
-
-FILES CHANGED:
-{files_text}
-
-CODE CHANGES:
-{diff}
-
-Please provide a detailed code review focusing on:
-
-1. **Security Analysis**
-   - Authentication and authorization issues
-   - Input validation problems
-   - Data protection concerns
-   - SQL injection vulnerabilities
-   - XSS and other web vulnerabilities
-
-2. **Performance Issues**
-   - Algorithm efficiency
-   - Memory usage
-   - Database query optimization
-   - Network operations
-   - Caching opportunities
-
-3. **Code Quality**
-   - Code structure and organization
-   - Readability and maintainability
-   - Error handling
-   - Testing coverage
-   - Documentation
-
-4. **Best Practices**
-   - Language-specific best practices
-   - Design patterns
-   - Code standards compliance
-   - Technical debt
-
-Format your response as:
-
-## 🔍 Code Review Summary
-[Overall assessment of the changes]
-
-## 🚨 Critical Issues
-- **File**: [filename]
-  - **Line**: [line number]
-  - **Issue**: [specific problem]
-  - **Risk**: [explanation of risk]
-  - **Fix**: [specific solution]
-
-## ⚠️ Warnings
-[High and medium priority issues]
-
-## 💡 Recommendations
-[General improvement suggestions]
-
-## 📊 Metrics
-- Files changed: {len(files)}
-- Estimated complexity change: [assessment]
-- Risk level: [Low/Medium/High/Critical]
-"""
+            # Assemble the prompt from its parts in one join
+            prompt = "".join((
+                AI_REVIEW_PROMPT_HEADER,
+                files_text,
+                "\n\nCODE CHANGES:\n",
+                self._truncate_diff(diff),
+                AI_REVIEW_PROMPT_TRAILER.format(files_count=len(files))
+            ))
             
             # Generate review
-            review = llm.invoke(prompt)
+            review = self.llm.invoke(prompt)
             return review
             
         except Exception as e:
             return f"Error generating AI review: {e}"
     
-    def apply_rules(self, diff: str, files: List[str]) -> List[dict]:
+    def _split_file_diffs(self, diff: str) -> List[Tuple[str, str, str]]:
+        """Split a diff into (file, language, diff) per changed file"""
+        # Committed, staged and working tree sections of one file are reviewed together
+        file_sections = defaultdict(list)
+        for section in DIFF_SECTION_START_RE.split(diff):
+            if section.strip():
+                file_sections[diff_section_path(section)].append(section)
+        return [
+            (file_path, self.diff_analyzer.detect_language(file_path), "".join(sections))
+            for file_path, sections in file_sections.items()
+        ]
+    
+    def generate_specialized_reviews(self, diff: str) -> Dict[Tuple[str, str], Any]:
+        """Run the specialized prompts applicable to each changed file, returning responses or exceptions by (file, prompt name)"""
+        async def file_diffs():
+            for file_diff in self._split_file_diffs(diff):
+                yield file_diff
+        
+        return asyncio.run(self.prompt_manager.asubmit_all(file_diffs(), self.llm))
+    
+    def write_batch_job(self, base_branch: str, current_branch: Optional[str], include_uncommitted: bool, output_file: str) -> int:
+        """Write the specialized prompts for every changed file as a batch job file, returning the number of requests"""
+        if current_branch is None:
+            current_branch = self.get_current_branch()
+        files = self._select_review_files(self.get_changed_files(base_branch, current_branch, include_uncommitted))
+        diff = self.get_diff(base_branch, current_branch, include_uncommitted, files) if files else ""
+        job = self.prompt_manager.build_batch_jsonl(self._split_file_diffs(diff))
+        with open(output_file, "wb") as f:
+            f.write(job)
+        return job.count(b"\n")
+    
+    def _format_specialized_reviews(self, responses: Dict[Tuple[str, str], Any]) -> str:
+        """Render specialized prompt responses as a report section, one subsection per file and prompt"""
+        parts = ["## 🧭 Specialized Reviews\n"]
+        for (file_path, prompt_name), response in responses.items():
+            parts.append(f"\n### `{file_path}` · {prompt_name}\n\n")
+            if isinstance(response, Exception):
+                parts.append(f"_Review failed: {response}_\n")
+            else:
+                parts.append(f"{response.strip() or '_No findings returned._'}\n")
+        return "".join(parts)
+    
+    def _truncate_diff(self, diff: str) -> str:
+        """Cut a diff to MAX_REVIEW_DIFF_CHARS, marking where it was cut"""
+        if len(diff) <= MAX_REVIEW_DIFF_CHARS:
+            return diff
+        return diff[:MAX_REVIEW_DIFF_CHARS] + "\n... [diff truncated]"
+    
+    def apply_rules(self, diff: str, files: List[str], ref: Optional[str] = None) -> List[dict]:
         """Apply configured rules to detect issues with detailed information"""
         issues = []
         rules = self.config.get("rules", [])
         
-        # Read file contents for rule matching
+        # Only AI rules need every file held at once; regex rules look at one file at a time
         file_contents = {}
-        for file_path in files:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    file_contents[file_path] = f.read()
-            except (UnicodeDecodeError, PermissionError, FileNotFoundError):
-                # Skip binary files or files we can't read
-                continue
+        needs_contents = any(rule.get('type', 'regex') == 'ai_analysis' for rule in rules)
+        if ref is None and not needs_contents:
+            file_texts = self._iter_text_files(files)
+        else:
+            # Read file contents for rule matching, from the working tree or from ref
+            if ref is None:
+                # Reads are I/O bound and independent, so overlap them
+                with ThreadPoolExecutor(max_workers=FILE_READ_WORKERS) as executor:
+                    for file_path, content in zip(files, executor.map(self._read_text_file, files)):
+                        if content is not None:
+                            file_contents[file_path] = content
+            else:
+                # The cat-file pipe serves one request at a time
+                for file_path in files:
+                    blob = self._cat_file(f"{ref}:{file_path}")
+                    content = self._decode_text(blob) if blob is not None else None
+                    if content is not None:
+                        file_contents[file_path] = content
+            file_texts = file_contents.items()
+        
+        # Match all regex rules against each file
+        regex_issues = self._match_regex_rules(file_texts)
         
         # Apply each rule
-        for rule in rules:
+        for index, rule in enumerate(rules):
             rule_name = rule['name']
             severity = rule['severity']
             description = rule['description']
             suggestion = rule['suggestion']
             rule_type = rule.get('type', 'regex')
             
-            import re
             rule_issues = []
             
             if rule_type == 'regex':
                 # Traditional regex-based rules
-                pattern = rule['pattern']
-                for file_path, content in file_contents.items():
-                    lines = content.split('\n')
-                    for line_num, line in enumerate(lines, 1):
-                        if re.search(pattern, line, re.IGNORECASE):
-                            # Extract the matching part
-                            match = re.search(pattern, line, re.IGNORECASE)
-                            matched_text = match.group(0) if match else line.strip()
-                            
-                            rule_issues.append({
-                                'file': file_path,
-                                'line': line_num,
-                                'code': line.strip(),
-                                'matched_text': matched_text,
-                                'rule': rule_name,
-                                'severity': severity,
-                                'description': description,
-                                'suggestion': suggestion
-                            })
+                rule_issues = regex_issues[index]
             
             elif rule_type == 'ai_analysis':
                 # AI-powered analysis rules
@@ -463,6 +607,128 @@ Format your response as:
         
         return issues
     
+    def _match_regex_rules(self, file_texts: Iterable[Tuple[str, str]]) -> Dict[int, List[dict]]:
+        """Report the first match of every regex rule on every line, returning issues keyed by rule index"""
+        regex_issues = defaultdict(list)
+        cache = self._open_rules_cache()
+        for file_path, content in file_texts:
+            # Files unchanged since the last run reuse their stored results
+            digest = hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+            cached = cache.get(file_path) if cache is not None else None
+            if cached is not None and cached[0] == digest:
+                file_issues = cached[1]
+            else:
+                file_issues = self._match_file_rules(file_path, content)
+                if cache is not None:
+                    cache[file_path] = (digest, file_issues)
+            for index, issues in file_issues.items():
+                regex_issues[index].extend(issues)
+        return regex_issues
+    
+    def _match_file_rules(self, file_path: str, content: str) -> Dict[int, List[dict]]:
+        """Match every regex rule against one file, returning its issues keyed by rule index"""
+        file_issues = {}
+        max_lines = self.config.get("review_settings", {}).get("max_lines_per_file") or None
+        content = self._first_lines(content, max_lines)
+        for index, rule, text_regex, line_regex in self._regex_rules:
+            # Scan the whole file in C and only do line bookkeeping on hits
+            pos = 0
+            line_num = 1
+            counted = 0
+            while pos <= len(content):
+                match = text_regex.search(content, pos)
+                if not match:
+                    break
+                line_start = content.rfind('\n', 0, match.start()) + 1
+                line_end = content.find('\n', match.start())
+                if line_end == -1:
+                    line_end = len(content)
+                line_num += content.count('\n', counted, line_start)
+                counted = line_start
+                
+                # A hit may span lines; the per-line pattern decides, exactly as a line-by-line scan would
+                line = content[line_start:line_end]
+                line_match = line_regex.search(line)
+                if line_match:
+                    file_issues.setdefault(index, []).append({
+                        'file': file_path,
+                        'line': line_num,
+                        'code': line.strip(),
+                        'matched_text': line_match.group(0),
+                        'rule': rule['name'],
+                        'severity': rule['severity'],
+                        'description': rule['description'],
+                        'suggestion': rule['suggestion']
+                    })
+                pos = line_end + 1
+        return file_issues
+    
+    def _open_rules_cache(self) -> Optional[shelve.Shelf]:
+        """Open the persistent regex rule cache, or return None if it cannot be used"""
+        if self._rules_cache is None:
+            try:
+                os.makedirs(os.path.dirname(RULES_CACHE_PATH), exist_ok=True)
+                cache = shelve.open(RULES_CACHE_PATH)
+            except (OSError, *dbm.error):
+                return None
+            # Results from other rules or settings are stale as a whole
+            if cache.get(RULES_VERSION_KEY) != self._rules_version:
+                cache.clear()
+                cache[RULES_VERSION_KEY] = self._rules_version
+            self._rules_cache = cache
+        return self._rules_cache
+    
+    def _first_lines(self, content: str, max_lines: Optional[int]) -> str:
+        """Cut content to its first max_lines lines"""
+        if max_lines is None or content.count('\n') < max_lines:
+            return content
+        end = -1
+        for _ in range(max_lines):
+            end = content.find('\n', end + 1)
+        return content[:end]
+    
+    def _iter_text_files(self, files: List[str]) -> Iterator[Tuple[str, str]]:
+        """Yield (path, content) for readable working tree text files, one file in memory at a time"""
+        for file_path in files:
+            content = self._read_text_file(file_path)
+            if content is not None:
+                yield file_path, content
+    
+    def _read_text_file(self, file_path: str) -> Optional[str]:
+        """Read a working tree file as UTF-8 text, or None if it is binary or unreadable"""
+        limit = self._max_text_bytes()
+        try:
+            with open(file_path, 'rb') as f:
+                # A NUL in the first bytes rules out binary assets without reading the rest
+                head = f.read(BINARY_SNIFF_BYTES)
+                if b'\0' in head:
+                    return None
+                # One byte past the limit tells _decode_text the file was cut
+                data = head + (f.read(limit + 1 - len(head)) if limit else f.read())
+        except (PermissionError, FileNotFoundError, IsADirectoryError):
+            return None
+        return self._decode_text(data)
+    
+    def _max_text_bytes(self) -> Optional[int]:
+        """Bytes of a file the rule checks can use, or None when max_lines_per_file is unset"""
+        max_lines = self.config.get("review_settings", {}).get("max_lines_per_file")
+        return max_lines * MAX_BYTES_PER_LINE if max_lines else None
+    
+    def _decode_text(self, data: bytes) -> Optional[str]:
+        """Decode file bytes as UTF-8 text with normalized line ends, cut to _max_text_bytes, or None if binary"""
+        if b'\0' in data[:BINARY_SNIFF_BYTES]:
+            return None
+        # Large files are checked up to the limit, the same whether read from the working tree or a ref
+        limit = self._max_text_bytes()
+        if limit and len(data) > limit:
+            # Cut after a line end so no multi-byte character is split
+            cut = data.rfind(b'\n', 0, limit)
+            data = data[:cut + 1 if cut != -1 else limit]
+        try:
+            return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+        except UnicodeDecodeError:
+            return None
+    
     def _apply_ai_analysis(self, file_path: str, content: str, prompt: str, rule_name: str, severity: str, suggestion: str) -> List[dict]:
         """Apply AI analysis to a single file"""
         try:
@@ -496,22 +762,27 @@ Format your response as a structured list of issues.
             print(f"Error in AI analysis for {file_path}: {e}")
             return []
     
+    @cached_property
+    def _analysis_model(self):
+        """Model and generation settings for AI analysis rules, configured once and reused for every file"""
+        import google.generativeai as genai
+        # Configure the model
+        genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+        ai_settings = self.config.get('ai_settings', {})
+        model = genai.GenerativeModel(ai_settings.get('model', 'models/gemini-2.5-pro'))
+        generation_config = genai.types.GenerationConfig(
+            temperature=ai_settings.get('temperature', 0.1),
+            max_output_tokens=ai_settings.get('max_tokens', 2000)
+        )
+        return model, generation_config
+    
     def _generate_ai_analysis(self, prompt: str) -> str:
         """Generate AI analysis using the configured model"""
         try:
-            import google.generativeai as genai
-            # Configure the model
-            genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-            model = genai.GenerativeModel(self.config.get('ai_settings', {}).get('model', 'models/gemini-2.5-pro'))
+            model, generation_config = self._analysis_model
             
             # Generate response
-            response = model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=self.config.get('ai_settings', {}).get('temperature', 0.1),
-                    max_output_tokens=self.config.get('ai_settings', {}).get('max_tokens', 2000)
-                )
-            )
+            response = model.generate_content(prompt, generation_config=generation_config)
             
             return response.text if response.text else ""
             
@@ -659,8 +930,34 @@ Format your response as a structured list of issues.
         
         return "\n".join(detailed_text)
     
-    def perform_review(self, base_branch: str, current_branch: Optional[str] = None, include_uncommitted: bool = True) -> ReviewReport:
-        """Perform comprehensive code review"""
+    def _select_review_files(self, all_files: List[str]) -> List[str]:
+        """Filter changed files and cap them at max_files_per_review"""
+        filtered_files = sorted(self.filter_files(all_files))
+        
+        # Bound the work on very large changesets; sorting keeps the cut deterministic
+        max_files = self.config.get("review_settings", {}).get("max_files_per_review")
+        if max_files and len(filtered_files) > max_files:
+            print(f"⚠️  Reviewing the first {max_files} of {len(filtered_files)} files (max_files_per_review)")
+            filtered_files = filtered_files[:max_files]
+        return filtered_files
+    
+    def _empty_report(self, base_branch: str, current_branch: str, message: str) -> ReviewReport:
+        """Build the report for a review with nothing to look at"""
+        return ReviewReport(
+            timestamp=datetime.now().isoformat(),
+            base_branch=base_branch,
+            current_branch=current_branch,
+            files_changed=[],
+            total_additions=0,
+            total_deletions=0,
+            summary={},
+            detailed_review=message,
+            recommendations=[],
+            risk_factors=[]
+        )
+    
+    def perform_review(self, base_branch: str, current_branch: Optional[str] = None, include_uncommitted: bool = True, analyze: bool = True, specialized: bool = False) -> ReviewReport:
+        """Perform comprehensive code review, optionally skipping the per-line diff analysis or adding specialized prompt reviews"""
         if current_branch is None:
             current_branch = self.get_current_branch()
         
@@ -670,72 +967,109 @@ Format your response as a structured list of issues.
         if include_uncommitted:
             print("📝 Including uncommitted changes in working directory")
         
-        # Get diff and changed files
-        diff = self.get_diff(base_branch, current_branch, include_uncommitted)
+        # Get changed files, then diff only the ones that survive filtering
         all_files = self.get_changed_files(base_branch, current_branch, include_uncommitted)
-        filtered_files = self.filter_files(all_files)
+        filtered_files = self._select_review_files(all_files)
+        
+        # Nothing left to diff means the filters, not the branches, emptied the review
+        if all_files and not filtered_files:
+            print(f"⚠️  All {len(all_files)} changed files were filtered out")
+            return self._empty_report(base_branch, current_branch, "All changed files were filtered out.")
+        
+        # Stream the diff from git through the analysis, keeping only the part the AI prompt can use
+        kept_diff = []
+        diff_lines = self._keep_diff_prefix(
+            self.iter_diff_lines(base_branch, current_branch, include_uncommitted, filtered_files),
+            kept_diff
+        )
+        
+        # Analyze diff, or only count its changed lines when analysis is skipped
+        if analyze:
+            analyses = self.diff_analyzer.analyze_diff(diff_lines)
+            summary = self.diff_analyzer.generate_summary(analyses)
+            total_additions = summary["summary"]["total_additions"]
+            total_deletions = summary["summary"]["total_deletions"]
+        else:
+            analyses = []
+            summary = {}
+            total_additions, total_deletions = self._count_changes(diff_lines)
+        diff = "".join(kept_diff)
         
         if not diff:
             print("❌ No differences found between branches")
-            return ReviewReport(
-                timestamp=datetime.now().isoformat(),
-                base_branch=base_branch,
-                current_branch=current_branch,
-                files_changed=[],
-                total_additions=0,
-                total_deletions=0,
-                summary={},
-                detailed_review="No changes found between branches.",
-                recommendations=[],
-                risk_factors=[]
-            )
+            return self._empty_report(base_branch, current_branch, "No changes found between branches.")
         
         print(f"📁 Found {len(all_files)} changed files")
         print(f"🎯 Reviewing {len(filtered_files)} files (after filtering)")
         
-        # Analyze diff
-        analyses = self.diff_analyzer.analyze_diff(diff)
-        summary = self.diff_analyzer.generate_summary(analyses)
-        
         # Apply rule-based analysis first
         print("🔍 Applying rule-based analysis...")
-        rule_issues = self.apply_rules(diff, filtered_files)
+        # Committed-only reviews read file contents from the branch, not the working tree
+        rule_issues = self.apply_rules(diff, filtered_files, None if include_uncommitted else current_branch)
         
         # Generate AI review
         print("🤖 Generating AI review...")
         ai_review = self.generate_ai_review(diff, filtered_files)
         
-        # Extract recommendations and risk factors
-        recommendations = []
-        risk_factors = []
+        # Extract recommendations and risk factors; dict keys dedupe while keeping first-seen order
+        recommendations = {}
+        risk_factors = {}
         
         # Add rule-based issues to recommendations and risk factors
         for issue in rule_issues:
             if issue['severity'] == 'error':
-                risk_factors.append(f"{issue['rule']}: {issue['description']}")
+                risk_factors[f"{issue['rule']}: {issue['description']}"] = None
             else:
-                recommendations.append(f"{issue['rule']}: {issue['description']}")
+                recommendations[f"{issue['rule']}: {issue['description']}"] = None
         
         # Generate detailed review text
         detailed_review = self.generate_detailed_review(rule_issues, ai_review)
         
+        if specialized:
+            print("🧭 Running specialized reviews per file...")
+            responses = self.generate_specialized_reviews(diff)
+            if responses:
+                detailed_review = f"{detailed_review}\n\n{self._format_specialized_reviews(responses)}"
+        
         for analysis in analyses:
-            recommendations.extend(analysis.suggestions)
-            risk_factors.extend(analysis.risk_factors)
+            recommendations.update(dict.fromkeys(analysis.suggestions))
+            risk_factors.update(dict.fromkeys(analysis.risk_factors))
         
         return ReviewReport(
             timestamp=datetime.now().isoformat(),
             base_branch=base_branch,
             current_branch=current_branch,
             files_changed=filtered_files,
-            total_additions=summary["summary"]["total_additions"],
-            total_deletions=summary["summary"]["total_deletions"],
+            total_additions=total_additions,
+            total_deletions=total_deletions,
             summary=summary,
             detailed_review=detailed_review,
-            recommendations=list(set(recommendations)),
-            risk_factors=list(set(risk_factors))
+            recommendations=list(recommendations),
+            risk_factors=list(risk_factors)
         )
     
+    def _keep_diff_prefix(self, lines: Iterable[str], kept: List[str]) -> Iterator[str]:
+        """Pass diff lines through, keeping them in kept until MAX_REVIEW_DIFF_CHARS is exceeded"""
+        # The line that crosses the limit is kept too, so _truncate_diff sees the diff was cut
+        size = 0
+        for line in lines:
+            if size <= MAX_REVIEW_DIFF_CHARS:
+                kept.append(line)
+                size += len(line)
+            yield line
+    
+    def _count_changes(self, diff: Union[str, Iterable[str]]) -> Tuple[int, int]:
+        """Count added and deleted lines in a diff in one pass, skipping file headers"""
+        additions = 0
+        deletions = 0
+        for line in diff.split('\n') if isinstance(diff, str) else diff:
+            if line.startswith('+'):
+                if not line.startswith('+++'):
+                    additions += 1
+            elif line.startswith('-') and not line.startswith('---'):
+                deletions += 1
+        return additions, deletions
+    
     def save_report(self, report: ReviewReport, output_file: str, format: str = "markdown"):
         """Save review report to file"""
         if format.lower() == "json":
@@ -757,35 +1091,35 @@ Format your response as a structured list of issues.
                 json.dump(report_dict, f, indent=2, ensure_ascii=False)
         
         else:
-            # Save as Markdown
+            # Save as Markdown, assembled in memory and written in one call
+            parts = [
+                f"# Code Review Report\n\n",
+                f"**Generated**: {report.timestamp}\n",
+                f"**Branch Comparison**: {report.base_branch} → {report.current_branch}\n",
+                f"**Files Changed**: {len(report.files_changed)}\n",
+                f"**Additions**: {report.total_additions}\n",
+                f"**Deletions**: {report.total_deletions}\n\n",
+                "## 📁 Changed Files\n\n"
+            ]
+            parts.extend(f"- {file}\n" for file in report.files_changed)
+            parts.append("\n")
+            
+            parts.append("## 🔍 Detailed Review\n\n")
+            parts.append(report.detailed_review)
+            parts.append("\n\n")
+            
+            if report.recommendations:
+                parts.append("## 💡 Recommendations\n\n")
+                parts.extend(f"- {rec}\n" for rec in report.recommendations)
+                parts.append("\n")
+            
+            if report.risk_factors:
+                parts.append("## ⚠️ Risk Factors\n\n")
+                parts.extend(f"- {risk}\n" for risk in report.risk_factors)
+                parts.append("\n")
+            
             with open(output_file, "w", encoding="utf-8") as f:
-                f.write(f"# Code Review Report\n\n")
-                f.write(f"**Generated**: {report.timestamp}\n")
-                f.write(f"**Branch Comparison**: {report.base_branch} → {report.current_branch}\n")
-                f.write(f"**Files Changed**: {len(report.files_changed)}\n")
-                f.write(f"**Additions**: {report.total_additions}\n")
-                f.write(f"**Deletions**: {report.total_deletions}\n\n")
-                
-                f.write("## 📁 Changed Files\n\n")
-                for file in report.files_changed:
-                    f.write(f"- {file}\n")
-                f.write("\n")
-                
-                f.write("## 🔍 Detailed Review\n\n")
-                f.write(report.detailed_review)
-                f.write("\n\n")
-                
-                if report.recommendations:
-                    f.write("## 💡 Recommendations\n\n")
-                    for rec in report.recommendations:
-                        f.write(f"- {rec}\n")
-                    f.write("\n")
-                
-                if report.risk_factors:
-                    f.write("## ⚠️ Risk Factors\n\n")
-                    for risk in report.risk_factors:
-                        f.write(f"- {risk}\n")
-                    f.write("\n")
+                f.write("".join(parts))
         
         print(f"📄 Report saved to: {output_file}")
 
@@ -799,9 +1133,15 @@ def main():
     parser.add_argument("--config", default=".github/code-review/config.json", help="Configuration file path")
     parser.add_argument("--include-uncommitted", action="store_true", default=True, help="Include uncommitted changes (default: True)")
     parser.add_argument("--committed-only", action="store_true", help="Only review committed changes")
+    parser.add_argument("--skip-analysis", action="store_true", help="Skip per-line diff analysis and only count changed lines")
+    parser.add_argument("--specialized", action="store_true", help="Also run the specialized security, performance, etc. prompts on each file (COMBINED_PROMPT=1 sends one request per file)")
     
     args = parser.parse_args()
     
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+    
     # Determine if we should include uncommitted changes
     include_uncommitted = args.include_uncommitted and not args.committed_only
     
@@ -817,12 +1157,22 @@ def main():
         print("  export GOOGLE_API_KEY='your_api_key_here'")
         sys.exit(1)
     
+    reviewer = None
     try:
         # Initialize reviewer
         reviewer = LocalCodeReviewer(args.config)
         
+        # Nightly reviews are written as a batch job and submitted separately at the batch discount
+        if os.getenv(REVIEW_MODE_ENV) == "batch":
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_file = args.output or f"code_review_batch_{timestamp}.jsonl"
+            count = reviewer.write_batch_job(args.base_branch, args.current_branch, include_uncommitted, output_file)
+            print(f"📦 Wrote {count} batch requests to {output_file}")
+            print("Submit it with the Gemini Batch API; each result's key maps back with ReviewPromptManager.parse_batch_key")
+            return
+        
         # Perform review
-        report = reviewer.perform_review(args.base_branch, args.current_branch, include_uncommitted)
+        report = reviewer.perform_review(args.base_branch, args.current_branch, include_uncommitted, not args.skip_analysis, args.specialized)
         
         # Display summary
         print("\n" + "="*60)
@@ -863,6 +1213,9 @@ def main():
     except Exception as e:
         print(f"❌ Error during code review: {e}")
         sys.exit(1)
+    finally:
+        if reviewer is not None:
+            reviewer.close()
 
 if __name__ == "__main__":
     main()
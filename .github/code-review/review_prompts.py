@@ -6,97 +6,165 @@ This module contains specialized prompts for different types of code reviews,
 including security, performance, maintainability, and best practices.
 """
 
-from typing import List, Dict, Any
-from dataclasses import dataclass
-
-@dataclass
+import os
+import re
+import json
+import asyncio
+import hashlib
+import textwrap
+from collections import defaultdict
+from operator import attrgetter
+from typing import List, Dict, Any, Tuple, FrozenSet, AsyncIterator, Optional
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
+
+# General-purpose languages every code review prompt applies to
+CODE_LANGUAGES = frozenset({"python", "javascript", "typescript", "java", "cpp", "c", "go", "rust"})
+
+# Languages of web front-end code
+WEB_LANGUAGES = frozenset({"javascript", "typescript", "html", "css"})
+
+# Languages commonly used to serve APIs
+API_LANGUAGES = CODE_LANGUAGES - {"cpp", "c"}
+
+# Languages each prompt applies to, by prompt name; checked without loading any template
+PROMPT_LANGUAGES = {
+    "security": CODE_LANGUAGES,
+    "performance": CODE_LANGUAGES,
+    "maintainability": CODE_LANGUAGES,
+    "best_practices": CODE_LANGUAGES,
+    "documentation": CODE_LANGUAGES,
+    "testing": CODE_LANGUAGES,
+    "accessibility": WEB_LANGUAGES,
+    "api_design": API_LANGUAGES
+}
+
+# Directory holding the prompt templates, read on first use
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+
+# Marks a content block for provider-side prompt caching (Anthropic message format)
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# File label opening each section of a batched prompt's response
+BATCH_LABEL_RE = re.compile(r"^\[(\d+)\]", re.MULTILINE)
+
+# Separates prompt name from file path in batch job request keys; prompt names never contain it
+BATCH_KEY_SEPARATOR = ":"
+
+# Bump to invalidate persisted prompt responses
+PROMPT_CACHE_VERSION = 1
+
+# Prompt LLM calls for one review allowed in flight at once
+PROMPT_MAX_CONCURRENCY = 4
+
+# Environment variable that, when set to 1, sends all prompts of a review as one combined request
+COMBINED_PROMPT_ENV = "COMBINED_PROMPT"
+
+# Marker before the diff in every template; the combined prompt states it once
+CODE_CHANGES_MARKER = "CODE CHANGES:"
+
+# Opening of a combined prompt, ahead of the individual reviews
+COMBINED_PROMPT_HEADER = (
+    "You are reviewing the code changes at the end of this message from several perspectives. "
+    "Carry out each review below in order and answer all of them in a single response, "
+    "using each review's own output format."
+)
+
+# Markdown section header line, the first of which opens each review's output
+SECTION_HEADER_RE = re.compile(r"^## .+$", re.MULTILINE)
+
+@lru_cache(maxsize=None)
+def _load_template(file_name: str) -> str:
+    """Read a prompt template from PROMPTS_DIR once, without surrounding blank lines or common indentation"""
+    with open(os.path.join(PROMPTS_DIR, file_name), "r", encoding="utf-8") as f:
+        return textwrap.dedent(f.read()).strip()
+
+@dataclass(slots=True, frozen=True)
 class ReviewPrompt:
     """Represents a specialized review prompt"""
     name: str
     description: str
     prompt_template: str
-    applicable_languages: List[str]
+    applicable_languages: FrozenSet[str]
     priority: int  # 1 = highest priority
+    batch_size: int = 4  # files reviewed per batched call
+    # Template text around the {diff} placeholder, split once so rendering is plain concatenation
+    prefix: str = field(init=False, repr=False)
+    suffix: str = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        prefix, _, suffix = self.prompt_template.partition("{diff}")
+        object.__setattr__(self, "prefix", prefix)
+        object.__setattr__(self, "suffix", suffix)
+    
+    def render(self, diff: str) -> str:
+        """Fill the template with a diff without re-parsing it"""
+        return f"{self.prefix}{diff}{self.suffix}"
+    
+    def render_batch(self, diffs: List[Tuple[str, str]]) -> str:
+        """Fill the template with several (file, diff) pairs labeled [1]..[N], sharing one checklist"""
+        changes = "\n".join(f"[{index}] file={file_path}\n{diff}" for index, (file_path, diff) in enumerate(diffs, 1))
+        return (
+            f"{self.prefix}{changes}\n\n"
+            f"Review each file separately. Start each file's section with its label [1] to [{len(diffs)}] "
+            f"on a line of its own, followed by the format below.{self.suffix}"
+        )
+    
+    def split_batch_response(self, response: str) -> Dict[int, str]:
+        """Split a batched response into sections by file label"""
+        labels = list(BATCH_LABEL_RE.finditer(response))
+        sections = {}
+        for label, next_label in zip(labels, labels[1:] + [None]):
+            end = next_label.start() if next_label else len(response)
+            sections[int(label.group(1))] = response[label.end():end].strip()
+        return sections
+    
+    def to_content_blocks(self, diff: str) -> List[Dict[str, Any]]:
+        """Render as message content blocks, marking the invariant checklist prefix as cacheable"""
+        return [
+            {"type": "text", "text": self.prefix, "cache_control": CACHE_CONTROL},
+            {"type": "text", "text": f"{diff}{self.suffix}"}
+        ]
 
 class ReviewPromptManager:
     """Manages different types of review prompts"""
     
-    def __init__(self):
-        self.prompts = self._initialize_prompts()
+    def __init__(self, response_cache_dir: Optional[str] = None):
+        # LLM responses are persisted here, keyed by rendered prompt, when set
+        self.response_cache_dir = response_cache_dir
+        # Prompt builders by name; each prompt is built on first use and then kept
+        self._builders = {
+            "security": self._get_security_prompt,
+            "performance": self._get_performance_prompt,
+            "maintainability": self._get_maintainability_prompt,
+            "best_practices": self._get_best_practices_prompt,
+            "documentation": self._get_documentation_prompt,
+            "testing": self._get_testing_prompt,
+            "accessibility": self._get_accessibility_prompt,
+            "api_design": self._get_api_design_prompt
+        }
+        self._cache: Dict[str, ReviewPrompt] = {}
+        # Applicable prompts per language, filled as languages are first seen
+        self._by_language: Dict[str, Tuple[ReviewPrompt, ...]] = {}
     
-    def _initialize_prompts(self) -> List[ReviewPrompt]:
-        """Initialize all review prompts"""
-        return [
-            self._get_security_prompt(),
-            self._get_performance_prompt(),
-            self._get_maintainability_prompt(),
-            self._get_best_practices_prompt(),
-            self._get_documentation_prompt(),
-            self._get_testing_prompt(),
-            self._get_accessibility_prompt(),
-            self._get_api_design_prompt()
-        ]
+    @property
+    def prompts(self) -> Tuple[ReviewPrompt, ...]:
+        """All review prompts, building any that have not been used yet"""
+        return tuple(self.get_prompt_by_name(name) for name in self._builders)
+    
+    @cached_property
+    def _sorted(self) -> Tuple[ReviewPrompt, ...]:
+        """All prompts sorted by priority, sorted once"""
+        return tuple(sorted(self.prompts, key=attrgetter("priority")))
     
     def _get_security_prompt(self) -> ReviewPrompt:
         """Security-focused review prompt"""
         return ReviewPrompt(
             name="security",
             description="Comprehensive security review",
-            applicable_languages=["python", "javascript", "typescript", "java", "cpp", "c", "go", "rust"],
+            applicable_languages=PROMPT_LANGUAGES["security"],
             priority=1,
-            prompt_template="""
-You are a cybersecurity expert conducting a thorough security review of the following code changes.
-
-SECURITY CHECKLIST:
-1. **Authentication & Authorization**
-   - Are user inputs properly validated and sanitized?
-   - Are authentication mechanisms secure?
-   - Are authorization checks in place?
-
-2. **Data Protection**
-   - Are sensitive data (passwords, keys, tokens) properly handled?
-   - Is data encryption used where appropriate?
-   - Are database queries protected against injection?
-
-3. **Input Validation**
-   - Are all user inputs validated?
-   - Are file uploads properly restricted?
-   - Are URL parameters sanitized?
-
-4. **Error Handling**
-   - Do error messages leak sensitive information?
-   - Are exceptions properly caught and handled?
-
-5. **Dependencies**
-   - Are third-party libraries up to date?
-   - Are known vulnerable packages used?
-
-CODE CHANGES:
-{diff}
-
-Please provide a detailed security analysis focusing on:
-- **Critical Issues**: Immediate security vulnerabilities
-- **High Risk**: Potential security concerns
-- **Medium Risk**: Security best practices violations
-- **Recommendations**: Specific security improvements
-
-Format your response as:
-## 🔒 Security Review Summary
-[Overall security assessment]
-
-## 🚨 Critical Security Issues
-- **File**: [filename]
-  - **Line**: [line number]
-  - **Issue**: [specific security vulnerability]
-  - **Risk**: [explanation of the risk]
-  - **Fix**: [specific remediation steps]
-
-## ⚠️ Security Warnings
-[High and medium risk issues]
-
-## 💡 Security Recommendations
-[General security improvements]
-"""
+            prompt_template=_load_template("security.md")
         )
     
     def _get_performance_prompt(self) -> ReviewPrompt:
@@ -104,63 +172,9 @@ Format your response as:
         return ReviewPrompt(
             name="performance",
             description="Performance optimization review",
-            applicable_languages=["python", "javascript", "typescript", "java", "cpp", "c", "go", "rust"],
+            applicable_languages=PROMPT_LANGUAGES["performance"],
             priority=2,
-            prompt_template="""
-You are a performance optimization expert reviewing the following code changes for efficiency and scalability.
-
-PERFORMANCE CHECKLIST:
-1. **Algorithm Complexity**
-   - Are algorithms optimal for the use case?
-   - Are there unnecessary nested loops?
-   - Are data structures chosen appropriately?
-
-2. **Memory Usage**
-   - Are there memory leaks?
-   - Is memory allocation efficient?
-   - Are large objects properly disposed?
-
-3. **Database Operations**
-   - Are queries optimized?
-   - Are indexes used appropriately?
-   - Are N+1 queries avoided?
-
-4. **Network Operations**
-   - Are API calls minimized?
-   - Is caching implemented where appropriate?
-   - Are timeouts configured?
-
-5. **Concurrency**
-   - Are race conditions handled?
-   - Is thread safety considered?
-   - Are async operations used appropriately?
-
-CODE CHANGES:
-{diff}
-
-Please provide a detailed performance analysis focusing on:
-- **Performance Bottlenecks**: Code that may cause slowdowns
-- **Memory Issues**: Potential memory leaks or excessive usage
-- **Scalability Concerns**: Issues that may impact scaling
-- **Optimization Opportunities**: Specific performance improvements
-
-Format your response as:
-## ⚡ Performance Review Summary
-[Overall performance assessment]
-
-## 🐌 Performance Bottlenecks
-- **File**: [filename]
-  - **Line**: [line number]
-  - **Issue**: [specific performance problem]
-  - **Impact**: [explanation of performance impact]
-  - **Solution**: [specific optimization approach]
-
-## 💾 Memory Concerns
-[Memory-related issues]
-
-## 📈 Optimization Recommendations
-[Specific performance improvements]
-"""
+            prompt_template=_load_template("performance.md")
         )
     
     def _get_maintainability_prompt(self) -> ReviewPrompt:
@@ -168,63 +182,9 @@ Format your response as:
         return ReviewPrompt(
             name="maintainability",
             description="Code maintainability and readability review",
-            applicable_languages=["python", "javascript", "typescript", "java", "cpp", "c", "go", "rust"],
+            applicable_languages=PROMPT_LANGUAGES["maintainability"],
             priority=3,
-            prompt_template="""
-You are a senior software engineer reviewing code for maintainability, readability, and long-term sustainability.
-
-MAINTAINABILITY CHECKLIST:
-1. **Code Structure**
-   - Is the code well-organized and modular?
-   - Are functions and classes appropriately sized?
-   - Is separation of concerns maintained?
-
-2. **Readability**
-   - Are variable and function names descriptive?
-   - Is the code self-documenting?
-   - Are complex logic sections commented?
-
-3. **Consistency**
-   - Does the code follow established patterns?
-   - Are coding standards consistently applied?
-   - Is the style consistent with the codebase?
-
-4. **Complexity**
-   - Is cyclomatic complexity reasonable?
-   - Are there overly complex functions?
-   - Can the code be easily understood by new developers?
-
-5. **Technical Debt**
-   - Are there TODO/FIXME comments that need attention?
-   - Are there code smells present?
-   - Is the code ready for production?
-
-CODE CHANGES:
-{diff}
-
-Please provide a detailed maintainability analysis focusing on:
-- **Code Quality**: Overall code quality assessment
-- **Readability Issues**: Code that's hard to understand
-- **Structural Problems**: Organization and architecture concerns
-- **Technical Debt**: Areas that need improvement
-
-Format your response as:
-## 🔧 Maintainability Review Summary
-[Overall maintainability assessment]
-
-## 📖 Readability Issues
-- **File**: [filename]
-  - **Line**: [line number]
-  - **Issue**: [specific readability problem]
-  - **Impact**: [why this affects maintainability]
-  - **Improvement**: [specific suggestions]
-
-## 🏗️ Structural Concerns
-[Architecture and organization issues]
-
-## 💳 Technical Debt
-[Areas requiring attention]
-"""
+            prompt_template=_load_template("maintainability.md")
         )
     
     def _get_best_practices_prompt(self) -> ReviewPrompt:
@@ -232,63 +192,9 @@ Format your response as:
         return ReviewPrompt(
             name="best_practices",
             description="Industry best practices review",
-            applicable_languages=["python", "javascript", "typescript", "java", "cpp", "c", "go", "rust"],
+            applicable_languages=PROMPT_LANGUAGES["best_practices"],
             priority=4,
-            prompt_template="""
-You are an expert software engineer reviewing code for adherence to industry best practices and modern development standards.
-
-BEST PRACTICES CHECKLIST:
-1. **Language-Specific Practices**
-   - Are language idioms used correctly?
-   - Are modern language features utilized?
-   - Are deprecated patterns avoided?
-
-2. **Error Handling**
-   - Are exceptions handled appropriately?
-   - Is error logging implemented?
-   - Are graceful degradation strategies in place?
-
-3. **Resource Management**
-   - Are resources properly closed/disposed?
-   - Is connection pooling used where appropriate?
-   - Are file handles managed correctly?
-
-4. **Configuration Management**
-   - Are configuration values externalized?
-   - Are environment-specific settings handled?
-   - Are secrets properly managed?
-
-5. **Logging and Monitoring**
-   - Is appropriate logging implemented?
-   - Are metrics and monitoring considered?
-   - Is debugging information available?
-
-CODE CHANGES:
-{diff}
-
-Please provide a detailed best practices analysis focusing on:
-- **Standards Compliance**: Adherence to coding standards
-- **Modern Practices**: Use of current best practices
-- **Anti-patterns**: Code that violates best practices
-- **Improvements**: Specific recommendations
-
-Format your response as:
-## ✅ Best Practices Review Summary
-[Overall best practices assessment]
-
-## 📋 Standards Compliance
-- **File**: [filename]
-  - **Line**: [line number]
-  - **Issue**: [specific standards violation]
-  - **Standard**: [which standard is violated]
-  - **Recommendation**: [specific improvement]
-
-## 🚫 Anti-patterns
-[Code that violates best practices]
-
-## 🎯 Improvement Opportunities
-[Specific best practice recommendations]
-"""
+            prompt_template=_load_template("best_practices.md")
         )
     
     def _get_documentation_prompt(self) -> ReviewPrompt:
@@ -296,58 +202,9 @@ Format your response as:
         return ReviewPrompt(
             name="documentation",
             description="Documentation and comments review",
-            applicable_languages=["python", "javascript", "typescript", "java", "cpp", "c", "go", "rust"],
+            applicable_languages=PROMPT_LANGUAGES["documentation"],
             priority=5,
-            prompt_template="""
-You are a technical writer reviewing code for documentation quality and completeness.
-
-DOCUMENTATION CHECKLIST:
-1. **Function Documentation**
-   - Do functions have clear docstrings/comments?
-   - Are parameters and return values documented?
-   - Are examples provided for complex functions?
-
-2. **API Documentation**
-   - Are public APIs well-documented?
-   - Are usage examples provided?
-   - Are edge cases documented?
-
-3. **Code Comments**
-   - Are complex algorithms explained?
-   - Are business logic decisions documented?
-   - Are non-obvious code sections commented?
-
-4. **README and Setup**
-   - Is setup documentation clear?
-   - Are dependencies listed?
-   - Are usage instructions provided?
-
-CODE CHANGES:
-{diff}
-
-Please provide a detailed documentation analysis focusing on:
-- **Missing Documentation**: Areas lacking documentation
-- **Documentation Quality**: Quality of existing documentation
-- **Clarity Issues**: Unclear or confusing documentation
-- **Completeness**: Documentation gaps
-
-Format your response as:
-## 📚 Documentation Review Summary
-[Overall documentation assessment]
-
-## ❌ Missing Documentation
-- **File**: [filename]
-  - **Function/Class**: [specific item]
-  - **Issue**: [what documentation is missing]
-  - **Importance**: [why this documentation is needed]
-  - **Suggestion**: [specific documentation to add]
-
-## 📝 Documentation Quality Issues
-[Problems with existing documentation]
-
-## 🔍 Clarity Improvements
-[Suggestions for clearer documentation]
-"""
+            prompt_template=_load_template("documentation.md")
         )
     
     def _get_testing_prompt(self) -> ReviewPrompt:
@@ -355,58 +212,9 @@ Format your response as:
         return ReviewPrompt(
             name="testing",
             description="Test coverage and quality review",
-            applicable_languages=["python", "javascript", "typescript", "java", "cpp", "c", "go", "rust"],
+            applicable_languages=PROMPT_LANGUAGES["testing"],
             priority=6,
-            prompt_template="""
-You are a QA engineer reviewing code for testability and test coverage.
-
-TESTING CHECKLIST:
-1. **Test Coverage**
-   - Are new functions/classes tested?
-   - Are edge cases covered?
-   - Are error conditions tested?
-
-2. **Test Quality**
-   - Are tests meaningful and not just coverage?
-   - Are tests maintainable?
-   - Are test data realistic?
-
-3. **Testability**
-   - Is the code testable?
-   - Are dependencies properly mocked?
-   - Are side effects minimized?
-
-4. **Test Organization**
-   - Are tests well-organized?
-   - Are test names descriptive?
-   - Are test utilities available?
-
-CODE CHANGES:
-{diff}
-
-Please provide a detailed testing analysis focusing on:
-- **Test Coverage**: Areas lacking test coverage
-- **Test Quality**: Quality of existing tests
-- **Testability Issues**: Code that's hard to test
-- **Testing Recommendations**: Specific testing improvements
-
-Format your response as:
-## 🧪 Testing Review Summary
-[Overall testing assessment]
-
-## 📊 Test Coverage Gaps
-- **File**: [filename]
-  - **Function/Class**: [specific item]
-  - **Issue**: [what testing is missing]
-  - **Risk**: [why this needs testing]
-  - **Suggestion**: [specific tests to add]
-
-## 🎯 Test Quality Issues
-[Problems with existing tests]
-
-## 🔧 Testability Improvements
-[Suggestions for more testable code]
-"""
+            prompt_template=_load_template("testing.md")
         )
     
     def _get_accessibility_prompt(self) -> ReviewPrompt:
@@ -414,61 +222,9 @@ Format your response as:
         return ReviewPrompt(
             name="accessibility",
             description="Web accessibility review",
-            applicable_languages=["javascript", "typescript", "html", "css"],
+            applicable_languages=PROMPT_LANGUAGES["accessibility"],
             priority=7,
-            prompt_template="""
-You are an accessibility expert reviewing web code for WCAG compliance and inclusive design.
-
-ACCESSIBILITY CHECKLIST:
-1. **Semantic HTML**
-   - Are semantic HTML elements used?
-   - Is the document structure logical?
-   - Are headings properly nested?
-
-2. **Keyboard Navigation**
-   - Is all functionality keyboard accessible?
-   - Is tab order logical?
-   - Are focus indicators visible?
-
-3. **Screen Reader Support**
-   - Are ARIA labels provided?
-   - Is alternative text provided for images?
-   - Are dynamic content changes announced?
-
-4. **Visual Design**
-   - Is color contrast sufficient?
-   - Is text resizable?
-   - Are interactive elements clearly identifiable?
-
-CODE CHANGES:
-{diff}
-
-Please provide a detailed accessibility analysis focusing on:
-- **WCAG Violations**: Specific accessibility violations
-- **Keyboard Issues**: Keyboard navigation problems
-- **Screen Reader Issues**: Problems for assistive technology
-- **Visual Issues**: Visual accessibility concerns
-
-Format your response as:
-## ♿ Accessibility Review Summary
-[Overall accessibility assessment]
-
-## 🚫 WCAG Violations
-- **File**: [filename]
-  - **Line**: [line number]
-  - **Issue**: [specific accessibility violation]
-  - **WCAG Level**: [A, AA, or AAA]
-  - **Fix**: [specific remediation]
-
-## ⌨️ Keyboard Navigation Issues
-[Problems with keyboard accessibility]
-
-## 🔊 Screen Reader Issues
-[Problems for assistive technology users]
-
-## 👁️ Visual Accessibility Issues
-[Visual design accessibility concerns]
-"""
+            prompt_template=_load_template("accessibility.md")
         )
     
     def _get_api_design_prompt(self) -> ReviewPrompt:
@@ -476,79 +232,204 @@ Format your response as:
         return ReviewPrompt(
             name="api_design",
             description="API design and RESTful practices review",
-            applicable_languages=["python", "javascript", "typescript", "java", "go", "rust"],
+            applicable_languages=PROMPT_LANGUAGES["api_design"],
             priority=8,
-            prompt_template="""
-You are an API design expert reviewing code for RESTful design principles and API best practices.
-
-API DESIGN CHECKLIST:
-1. **RESTful Design**
-   - Are HTTP methods used correctly?
-   - Are URLs resource-oriented?
-   - Is statelessness maintained?
-
-2. **Response Design**
-   - Are status codes appropriate?
-   - Is response format consistent?
-   - Are error responses informative?
-
-3. **Request Design**
-   - Are query parameters used appropriately?
-   - Is request validation implemented?
-   - Are content types handled correctly?
-
-4. **Versioning**
-   - Is API versioning implemented?
-   - Is backward compatibility maintained?
-   - Are breaking changes handled?
-
-5. **Security**
-   - Is authentication implemented?
-   - Is authorization checked?
-   - Are rate limits considered?
-
-CODE CHANGES:
-{diff}
-
-Please provide a detailed API design analysis focusing on:
-- **REST Violations**: Deviations from REST principles
-- **Design Issues**: Poor API design choices
-- **Security Concerns**: API security problems
-- **Best Practices**: Specific API improvements
-
-Format your response as:
-## 🌐 API Design Review Summary
-[Overall API design assessment]
-
-## 🚫 REST Violations
-- **File**: [filename]
-  - **Line**: [line number]
-  - **Issue**: [specific REST violation]
-  - **Principle**: [which REST principle is violated]
-  - **Fix**: [specific correction]
-
-## 🎨 Design Issues
-[Poor API design choices]
-
-## 🔒 Security Concerns
-[API security problems]
-
-## 📈 Best Practice Recommendations
-[Specific API improvements]
-"""
+            prompt_template=_load_template("api_design.md")
         )
     
-    def get_prompts_for_language(self, language: str) -> List[ReviewPrompt]:
-        """Get applicable prompts for a specific language"""
-        return [prompt for prompt in self.prompts if language in prompt.applicable_languages]
+    def applicable(self, name: str, language: str) -> bool:
+        """Whether a prompt applies to a language, checked before its template is loaded or the LLM is called"""
+        try:
+            return language in PROMPT_LANGUAGES[name]
+        except KeyError:
+            raise ValueError(f"Prompt '{name}' not found") from None
+    
+    def get_prompts_for_language(self, language: str) -> Tuple[ReviewPrompt, ...]:
+        """Get applicable prompts for a specific language, building only those"""
+        prompts = self._by_language.get(language)
+        if prompts is None:
+            prompts = self._by_language[language] = tuple(
+                self.get_prompt_by_name(name) for name in self._builders if self.applicable(name, language)
+            )
+        return prompts
+    
+    async def arun_all(self, diff: str, language: str, llm, max_concurrency: int = PROMPT_MAX_CONCURRENCY) -> Dict[str, Any]:
+        """Run every prompt applicable to a language concurrently, returning each response or exception by prompt name"""
+        return await self._arun_file(diff, language, llm, asyncio.Semaphore(max_concurrency))
+    
+    async def _arun_file(self, diff: str, language: str, llm, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        """Run the prompts applicable to one diff, as one combined request when COMBINED_PROMPT=1"""
+        prompts = self.get_prompts_for_language(language)
+        if prompts and os.getenv(COMBINED_PROMPT_ENV) == "1":
+            # One round trip for the whole review plan instead of one per prompt
+            try:
+                response = await self._ainvoke(llm, self.render_combined(diff, language), semaphore)
+            except Exception as e:
+                return {prompt.name: e for prompt in prompts}
+            return self.split_combined_response(response, language)
+        
+        responses = await asyncio.gather(
+            *(self._ainvoke(llm, prompt.render(diff), semaphore) for prompt in prompts), return_exceptions=True
+        )
+        return {prompt.name: response for prompt, response in zip(prompts, responses)}
+    
+    def run_all(self, diff: str, language: str, llm, max_concurrency: int = PROMPT_MAX_CONCURRENCY) -> Dict[str, Any]:
+        """Synchronous wrapper around arun_all"""
+        return asyncio.run(self.arun_all(diff, language, llm, max_concurrency))
+    
+    async def asubmit_all(self, file_diffs: AsyncIterator[Tuple[str, str, str]], llm,
+                          max_concurrency: int = PROMPT_MAX_CONCURRENCY) -> Dict[Tuple[str, str], Any]:
+        """Start the applicable prompts for each (file, language, diff) as it arrives, returning responses or exceptions by (file, prompt name)"""
+        semaphore = asyncio.Semaphore(max_concurrency)
+        combined = os.getenv(COMBINED_PROMPT_ENV) == "1"
+        languages: Dict[str, str] = {}
+        # Files of one language waiting to share a call, by (language, prompt name)
+        pending: Dict[Tuple[str, str], List[Tuple[str, str]]] = defaultdict(list)
+        tasks = []
+        try:
+            # Calls for earlier files run while later diffs are still being produced
+            async for file_path, language, diff in file_diffs:
+                languages[file_path] = language
+                if combined:
+                    # Already one call per file covering every prompt
+                    tasks.append(asyncio.create_task(self._arun_combined_file(file_path, diff, language, llm, semaphore)))
+                    continue
+                for prompt in self.get_prompts_for_language(language):
+                    batch = pending[(language, prompt.name)]
+                    batch.append((file_path, diff))
+                    if len(batch) == prompt.batch_size:
+                        tasks.append(asyncio.create_task(self._arun_batch(prompt, batch, llm, semaphore)))
+                        del pending[(language, prompt.name)]
+            for (language, name), batch in pending.items():
+                prompt = self.get_prompt_by_name(name)
+                tasks.append(asyncio.create_task(self._arun_batch(prompt, batch, llm, semaphore)))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        
+        responses: Dict[Tuple[str, str], Any] = {}
+        for batch_responses in await asyncio.gather(*tasks):
+            responses.update(batch_responses)
+        # Files in arrival order, then prompts in their usual order
+        return {
+            (file_path, prompt.name): responses[(file_path, prompt.name)]
+            for file_path, language in languages.items()
+            for prompt in self.get_prompts_for_language(language)
+        }
+    
+    async def _arun_combined_file(self, file_path: str, diff: str, language: str, llm,
+                                  semaphore: asyncio.Semaphore) -> Dict[Tuple[str, str], Any]:
+        """Run the prompts for one file as a combined request, keyed by (file, prompt name)"""
+        file_responses = await self._arun_file(diff, language, llm, semaphore)
+        return {(file_path, name): response for name, response in file_responses.items()}
+    
+    async def _arun_batch(self, prompt: ReviewPrompt, batch: List[Tuple[str, str]], llm,
+                          semaphore: asyncio.Semaphore) -> Dict[Tuple[str, str], Any]:
+        """Run one prompt over several (file, diff) pairs in a single call, split back per file"""
+        # A lone file uses the plain template, so its response is the file's review as is
+        rendered = prompt.render(batch[0][1]) if len(batch) == 1 else prompt.render_batch(batch)
+        try:
+            response = await self._ainvoke(llm, rendered, semaphore)
+        except Exception as e:
+            return {(file_path, prompt.name): e for file_path, _ in batch}
+        if len(batch) == 1:
+            return {(batch[0][0], prompt.name): response}
+        sections = prompt.split_batch_response(response)
+        return {(file_path, prompt.name): sections.get(index, "") for index, (file_path, _) in enumerate(batch, 1)}
+    
+    def build_batch_jsonl(self, file_diffs: List[Tuple[str, str, str]]) -> bytes:
+        """Serialize the applicable prompts for each (file, language, diff) as Gemini Batch API JSONL"""
+        lines = []
+        for file_path, language, diff in file_diffs:
+            for prompt in self.get_prompts_for_language(language):
+                request = {
+                    "key": f"{prompt.name}{BATCH_KEY_SEPARATOR}{file_path}",
+                    "request": {"contents": [{"parts": [{"text": prompt.render(diff)}]}]}
+                }
+                lines.append(json.dumps(request, ensure_ascii=False))
+        return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+    
+    @staticmethod
+    def parse_batch_key(key: str) -> Tuple[str, str]:
+        """Map a batch job request key back to its (file, prompt name)"""
+        prompt_name, _, file_path = key.partition(BATCH_KEY_SEPARATOR)
+        return file_path, prompt_name
+    
+    def render_combined(self, diff: str, language: str) -> str:
+        """Combine every prompt applicable to a language into one request, with the diff stated once at the end"""
+        reviews = []
+        for index, prompt in enumerate(self.get_prompts_for_language(language), 1):
+            checklist = prompt.prefix.rsplit(CODE_CHANGES_MARKER, 1)[0].strip()
+            reviews.append(f"### Review {index}: {prompt.description}\n\n{checklist}\n\n{prompt.suffix.strip()}")
+        return "\n\n".join([COMBINED_PROMPT_HEADER, *reviews, f"{CODE_CHANGES_MARKER}\n{diff}"])
+    
+    def split_combined_response(self, response: str, language: str) -> Dict[str, str]:
+        """Split a combined response into each prompt's section by its summary header, empty when missing"""
+        starts = {}
+        for prompt in self.get_prompts_for_language(language):
+            header = SECTION_HEADER_RE.search(prompt.suffix)
+            position = response.find(header.group(0)) if header else -1
+            if position != -1:
+                starts[prompt.name] = position
+        
+        sections = {prompt.name: "" for prompt in self.get_prompts_for_language(language)}
+        ordered = sorted(starts.items(), key=lambda item: item[1])
+        for (name, start), following in zip(ordered, ordered[1:] + [(None, len(response))]):
+            sections[name] = response[start:following[1]].strip()
+        return sections
+    
+    async def _ainvoke(self, llm, rendered: str, semaphore: asyncio.Semaphore):
+        """Call the LLM with a rendered prompt once a concurrency slot is free, unless a persisted response exists"""
+        cache_path = self._response_cache_path(llm, rendered)
+        if cache_path is not None:
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    return json.load(f)["response"]
+            except (OSError, ValueError, KeyError):
+                pass
+        
+        async with semaphore:
+            response = await llm.ainvoke(rendered)
+        
+        # Only text responses are persisted; failures raise and are retried next run
+        if cache_path is not None and isinstance(response, str):
+            try:
+                os.makedirs(self.response_cache_dir, exist_ok=True)
+                # Write then rename so concurrent runs never read a partial file
+                temp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump({"response": response}, f, ensure_ascii=False)
+                os.replace(temp_path, cache_path)
+            except OSError as e:
+                print(f"Warning: could not persist prompt response: {e}")
+        return response
+    
+    def _response_cache_path(self, llm, rendered: str) -> Optional[str]:
+        """Persisted response file for a rendered prompt and model, or None when responses are not persisted"""
+        if self.response_cache_dir is None:
+            return None
+        model = getattr(llm, "model", type(llm).__name__)
+        key = hashlib.blake2b(f"{PROMPT_CACHE_VERSION}\0{model}\0".encode("utf-8"), digest_size=16)
+        key.update(rendered.encode("utf-8", "surrogatepass"))
+        return os.path.join(self.response_cache_dir, f"{key.hexdigest()}.json")
     
     def get_prompt_by_name(self, name: str) -> ReviewPrompt:
         """Get a specific prompt by name"""
-        for prompt in self.prompts:
-            if prompt.name == name:
-                return prompt
-        raise ValueError(f"Prompt '{name}' not found")
+        prompt = self._cache.get(name)
+        if prompt is None:
+            try:
+                builder = self._builders[name]
+            except KeyError:
+                raise ValueError(f"Prompt '{name}' not found") from None
+            prompt = self._cache[name] = builder()
+        return prompt
     
-    def get_all_prompts(self) -> List[ReviewPrompt]:
+    def get_all_prompts(self) -> Tuple[ReviewPrompt, ...]:
         """Get all available prompts sorted by priority"""
-        return sorted(self.prompts, key=lambda x: x.priority)
+        return self._sorted
+
+@lru_cache(maxsize=None)
+def get_manager(response_cache_dir: Optional[str] = None) -> ReviewPromptManager:
+    """Shared prompt manager per response cache directory, so prompts are built once per process"""
+    return ReviewPromptManager(response_cache_dir)
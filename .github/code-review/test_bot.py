@@ -4,29 +4,21 @@ Test script for AI Code Review Bot
 
 This script provides basic testing functionality for the code review bot
 without requiring actual GitHub API calls.
+
+Run with: python -m pytest .github/code-review/test_bot.py
 """
 
 import os
 import sys
 import json
-from unittest.mock import Mock, patch
+import asyncio
+import pytest
+from unittest.mock import Mock, MagicMock, AsyncMock
 from diff_analyzer import DiffAnalyzer
-from review_prompts import ReviewPromptManager
+from review_prompts import ReviewPromptManager, get_manager
 
-def test_diff_analyzer():
-    """Test the diff analyzer functionality"""
-    print("🧪 Testing Diff Analyzer...")
-    
-    analyzer = DiffAnalyzer()
-    
-    # Test language detection
-    assert analyzer.detect_language("test.py") == "python"
-    assert analyzer.detect_language("test.js") == "javascript"
-    assert analyzer.detect_language("test.java") == "java"
-    print("✅ Language detection working")
-    
-    # Test diff parsing
-    sample_diff = """
+# Diff parsed by the diff analyzer tests
+SAMPLE_DIFF = """
 diff --git a/test.py b/test.py
 index 1234567..abcdefg 100644
 --- a/test.py
@@ -37,77 +29,233 @@ index 1234567..abcdefg 100644
 +    print("Hello World")
 +    return True
 """
-    
-    analyses = analyzer.analyze_diff(sample_diff)
-    assert len(analyses) == 1
-    assert analyses[0].file_path == "test.py"
-    assert analyses[0].total_additions == 2
-    assert analyses[0].total_deletions == 1
-    print("✅ Diff parsing working")
-    
-    # Test summary generation
-    summary = analyzer.generate_summary(analyses)
+
+# Diff parsed by test_mock_github_api
+MOCK_DIFF = """
+diff --git a/test.py b/test.py
+index 1234567..abcdefg 100644
+--- a/test.py
++++ b/test.py
+@@ -1,3 +1,6 @@
+ def hello():
+-    print("Hello")
++    print("Hello World")
++    return True
++
++def goodbye():
++    print("Goodbye")
+"""
+
+# Repository root, where aibot.py lives
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Regex rule used by the rules cache tests
+PASSWORD_RULE = {"name": "password", "description": "Hardcoded password", "severity": "error", "pattern": "password", "suggestion": "Use a secret store"}
+
+def mock_response(status_code, chunks=(), etag=None, error=None):
+    """Streamed GitHub response yielding chunks, then raising error if given"""
+    def iter_content(chunk_size):
+        yield from chunks
+        if error:
+            raise error
+    response = MagicMock(status_code=status_code, headers={"ETag": etag} if etag else {})
+    response.__enter__.return_value = response
+    response.iter_content = iter_content
+    return response
+
+@pytest.fixture
+def github_client(tmp_path, monkeypatch):
+    """GitHub client whose ETag cache lives in a temporary directory"""
+    pytest.importorskip("requests")
+    import code_review_bot
+    monkeypatch.setattr(code_review_bot, "ETAG_CACHE_DIR", str(tmp_path))
+    client = code_review_bot.GitHubAPIClient("token", "owner", "repo")
+    monkeypatch.setattr(client.session, "get", Mock())
+    return client
+
+def make_reviewer(tmp_path, rules):
+    """Local reviewer with the given regex rules and its rules cache in tmp_path"""
+    import local_review
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"rules": rules, "review_settings": {"max_lines_per_file": 1000}}))
+    return local_review.LocalCodeReviewer(str(config_path))
+
+@pytest.fixture
+def rules_cache(tmp_path, monkeypatch):
+    """Point the regex rules cache at a temporary directory"""
+    pytest.importorskip("requests")
+    import local_review
+    monkeypatch.setattr(local_review, "RULES_CACHE_PATH", str(tmp_path / "cache" / "rules"))
+
+@pytest.fixture(scope="module")
+def aibot():
+    """The RAG bot module, when its runtime dependencies are installed"""
+    for module in ("faiss", "numpy", "langchain_community", "langchain_google_genai"):
+        pytest.importorskip(module)
+    # Keep the import from prompting for a key
+    os.environ.setdefault("GOOGLE_API_KEY", "test")
+    sys.path.insert(0, REPO_ROOT)
+    import aibot
+    return aibot
+
+@pytest.fixture(scope="module")
+def analyzer():
+    """Diff analyzer shared by the tests in this module"""
+    return DiffAnalyzer()
+
+@pytest.fixture(scope="module")
+def sample_analyses(analyzer):
+    """SAMPLE_DIFF parsed once for every test that inspects it"""
+    return analyzer.analyze_diff(SAMPLE_DIFF)
+
+@pytest.fixture(scope="module")
+def manager():
+    """Shared review prompt manager"""
+    return get_manager()
+
+@pytest.fixture(scope="module")
+def python_prompts(manager):
+    """Prompts applicable to Python code"""
+    return manager.get_prompts_for_language("python")
+
+@pytest.mark.parametrize("path,language", [("test.py", "python"), ("test.js", "javascript"), ("test.java", "java")])
+def test_language_detection(analyzer, path, language):
+    """Test language detection from file extensions"""
+    assert analyzer.detect_language(path) == language
+
+def test_diff_parsing(sample_analyses):
+    """Test diff parsing"""
+    assert len(sample_analyses) == 1
+    assert sample_analyses[0].file_path == "test.py"
+    assert sample_analyses[0].total_additions == 2
+    assert sample_analyses[0].total_deletions == 1
+
+def test_summary_generation(analyzer, sample_analyses):
+    """Test summary generation"""
+    summary = analyzer.generate_summary(sample_analyses)
     assert summary['summary']['total_files_changed'] == 1
     assert summary['summary']['total_additions'] == 2
     assert summary['summary']['total_deletions'] == 1
-    print("✅ Summary generation working")
 
-def test_review_prompts():
-    """Test the review prompts functionality"""
-    print("🧪 Testing Review Prompts...")
-    
-    manager = ReviewPromptManager()
-    
-    # Test getting prompts for specific language
-    python_prompts = manager.get_prompts_for_language("python")
+def test_language_specific_prompts(python_prompts):
+    """Test getting prompts for specific language"""
     assert len(python_prompts) > 0
-    print("✅ Language-specific prompts working")
-    
-    # Test getting specific prompt
+
+def test_prompt_applicability(manager):
+    """Test checking whether a prompt applies to a language"""
+    assert manager.applicable("accessibility", "css")
+    assert not manager.applicable("accessibility", "python")
+    fresh_manager = ReviewPromptManager()
+    fresh_manager.get_prompts_for_language("python")
+    assert "accessibility" not in fresh_manager._cache
+
+def test_concurrent_prompt_runs(manager, python_prompts):
+    """Test running applicable prompts concurrently"""
+    llm = Mock(ainvoke=AsyncMock(side_effect=["ok"] * (len(python_prompts) - 1) + [RuntimeError("rate limited")]))
+    responses = manager.run_all("+x = 1", "python", llm)
+    assert list(responses) == [prompt.name for prompt in python_prompts]
+    assert isinstance(responses[python_prompts[-1].name], RuntimeError)
+
+def test_combined_prompt_run(manager, python_prompts, monkeypatch):
+    """Test all applicable prompts can be sent as one request and split back per prompt"""
+    monkeypatch.setenv("COMBINED_PROMPT", "1")
+    combined = manager.render_combined("+x = 1", "python")
+    assert combined.count("+x = 1") == 1
+    response = "## 🔒 Security Review Summary\nSafe\n\n## ⚡ Performance Review Summary\nFast"
+    llm = Mock(ainvoke=AsyncMock(return_value=response))
+    responses = manager.run_all("+x = 1", "python", llm)
+    assert llm.ainvoke.await_count == 1
+    assert responses["security"] == "## 🔒 Security Review Summary\nSafe"
+    assert responses["performance"] == "## ⚡ Performance Review Summary\nFast"
+    assert responses["testing"] == ""
+
+def test_streaming_prompt_submission(manager, python_prompts):
+    """Test prompts are submitted per file as diffs arrive"""
+    async def file_diffs():
+        yield "a.py", "python", "+x = 1"
+        yield "b.css", "css", "+a { color: red; }"
+    llm = Mock(ainvoke=AsyncMock(return_value="ok"))
+    responses = asyncio.run(manager.asubmit_all(file_diffs(), llm))
+    assert ("a.py", "security") in responses and ("b.css", "accessibility") in responses
+    assert llm.ainvoke.await_count == len(python_prompts) + len(manager.get_prompts_for_language("css"))
+
+def test_batched_prompt_submission(manager, python_prompts):
+    """Test files of one language share a call per prompt and get their own section back"""
+    async def file_diffs():
+        yield "a.py", "python", "+x = 1"
+        yield "b.py", "python", "+y = 2"
+    llm = Mock(ainvoke=AsyncMock(return_value="[1]\nFine\n[2]\n## Issue\n- y"))
+    responses = asyncio.run(manager.asubmit_all(file_diffs(), llm))
+    assert llm.ainvoke.await_count == len(python_prompts)
+    assert responses[("a.py", "security")] == "Fine"
+    assert responses[("b.py", "security")] == "## Issue\n- y"
+
+def test_batch_job_serialization(manager, python_prompts):
+    """Test batch job requests map back to their file and prompt"""
+    lines = manager.build_batch_jsonl([("src/a:b.py", "python", "+x = 1")]).decode("utf-8").splitlines()
+    assert len(lines) == len(python_prompts)
+    assert manager.parse_batch_key(json.loads(lines[0])["key"]) == ("src/a:b.py", python_prompts[0].name)
+
+def test_prompt_response_cache(tmp_path, python_prompts):
+    """Test persisted responses are reused instead of calling the LLM again"""
+    cached_manager = ReviewPromptManager(response_cache_dir=str(tmp_path))
+    llm = Mock(model="test-model", ainvoke=AsyncMock(return_value="ok"))
+    first = cached_manager.run_all("+x = 1", "python", llm)
+    second = cached_manager.run_all("+x = 1", "python", llm)
+    assert first == second
+    assert llm.ainvoke.await_count == len(python_prompts)
+
+def test_prompt_retrieval(manager):
+    """Test getting specific prompt"""
     security_prompt = manager.get_prompt_by_name("security")
     assert security_prompt.name == "security"
     assert "security" in security_prompt.prompt_template.lower()
-    print("✅ Specific prompt retrieval working")
-    
-    # Test getting all prompts
+
+def test_prompt_rendering(manager):
+    """Test rendering matches formatting the template"""
+    security_prompt = manager.get_prompt_by_name("security")
+    assert security_prompt.render("+x = 1") == security_prompt.prompt_template.format(diff="+x = 1")
+    blocks = security_prompt.to_content_blocks("+x = 1")
+    assert "".join(block["text"] for block in blocks) == security_prompt.render("+x = 1")
+    batch = security_prompt.render_batch([("a.py", "+x = 1"), ("b.py", "+y = 2")])
+    assert "[1] file=a.py\n+x = 1" in batch and "[2] file=b.py\n+y = 2" in batch
+    sections = security_prompt.split_batch_response("[1]\nFine\n[2]\n## Issue\n- y")
+    assert sections == {1: "Fine", 2: "## Issue\n- y"}
+
+def test_priority_sorting(manager):
+    """Test getting all prompts"""
     all_prompts = manager.get_all_prompts()
     assert len(all_prompts) > 0
     assert all_prompts[0].priority <= all_prompts[1].priority
-    print("✅ Priority sorting working")
+
+def test_shared_manager(manager):
+    """Test the shared manager is reused"""
+    assert get_manager() is manager
 
 def test_config_loading():
     """Test configuration loading"""
-    print("🧪 Testing Configuration Loading...")
-    
     # Test if config file exists and is valid JSON
     if os.path.exists(".github/code-review/config.json"):
         with open(".github/code-review/config.json", "r") as f:
             config = json.load(f)
-        
+    
         assert "rules" in config
         assert "ai_settings" in config
         assert "review_settings" in config
-        print("✅ Configuration file valid")
     else:
         print("⚠️  Configuration file not found - this is expected for testing")
 
 def test_environment_variables():
     """Test environment variable handling"""
-    print("🧪 Testing Environment Variables...")
-    
     # Test required variables
     required_vars = ["GITHUB_TOKEN", "GOOGLE_API_KEY", "REPO_OWNER", "REPO_NAME"]
     
     for var in required_vars:
-        if os.getenv(var):
-            print(f"✅ {var} is set")
-        else:
+        if not os.getenv(var):
             print(f"⚠️  {var} is not set (expected for testing)")
 
-def mock_github_api_test():
+def test_mock_github_api(analyzer):
     """Test with mocked GitHub API"""
-    print("🧪 Testing with Mocked GitHub API...")
-    
     # Mock GitHub API responses
     mock_files = [
         {
@@ -119,93 +267,88 @@ def mock_github_api_test():
         }
     ]
     
-    mock_diff = """
-diff --git a/test.py b/test.py
-index 1234567..abcdefg 100644
---- a/test.py
-+++ b/test.py
-@@ -1,3 +1,6 @@
- def hello():
--    print("Hello")
-+    print("Hello World")
-+    return True
-+
-+def goodbye():
-+    print("Goodbye")
-"""
-    
     # Test with mocked data
-    analyzer = DiffAnalyzer()
-    analyses = analyzer.analyze_diff(mock_diff)
+    analyses = analyzer.analyze_diff(MOCK_DIFF)
     
     assert len(analyses) == 1
     assert analyses[0].file_path == "test.py"
-    assert analyses[0].total_additions == 4
+    assert analyses[0].total_additions == 5
     assert analyses[0].total_deletions == 1
-    
-    print("✅ Mocked API test working")
 
-def run_integration_test():
-    """Run a basic integration test"""
-    print("🧪 Running Integration Test...")
-    
+def test_etag_cache_reuses_body_when_not_modified(github_client):
+    """Test a 304 answer is served from the stored body"""
+    url = "https://api.github.com/repos/owner/repo/pulls/1"
+    github_client.session.get.return_value = mock_response(200, [b"diff ", b"body"], etag='"v1"')
+    assert b"".join(github_client._iter_cached(url)) == b"diff body"
+    github_client.session.get.return_value = mock_response(304)
+    assert b"".join(github_client._iter_cached(url)) == b"diff body"
+    assert github_client.session.get.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+
+def test_etag_cache_ignores_truncated_stream(github_client, tmp_path):
+    """Test a body cut off mid-stream never replaces the cached one"""
+    url = "https://api.github.com/repos/owner/repo/pulls/1"
+    github_client.session.get.return_value = mock_response(200, [b"complete"], etag='"v1"')
+    b"".join(github_client._iter_cached(url))
+    github_client.session.get.return_value = mock_response(200, [b"part"], etag='"v2"', error=ConnectionError("reset"))
+    with pytest.raises(ConnectionError):
+        b"".join(github_client._iter_cached(url))
+    assert len(os.listdir(tmp_path)) == 1
+    github_client.session.get.return_value = mock_response(304)
+    assert b"".join(github_client._iter_cached(url)) == b"complete"
+    assert github_client.session.get.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+
+def test_rules_cache_invalidation(tmp_path, rules_cache):
+    """Test cached rule results are reused only for unchanged files and rules"""
+    reviewer = make_reviewer(tmp_path, [PASSWORD_RULE])
     try:
-        # Test importing all modules
-        import sys
-        import os
-        sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-        
-        from code_review_bot import CodeReviewBot, GitHubAPIClient
-        from diff_analyzer import DiffAnalyzer
-        from review_prompts import ReviewPromptManager
-        
-        print("✅ All modules imported successfully")
-        
-        # Test basic functionality
-        analyzer = DiffAnalyzer()
-        manager = ReviewPromptManager()
-        
-        print("✅ Core components initialized successfully")
-        
-        return True
-        
-    except Exception as e:
-        print(f"❌ Integration test failed: {e}")
-        return False
-
-def main():
-    """Run all tests"""
-    print("🚀 Starting AI Code Review Bot Tests\n")
-    
-    tests = [
-        test_diff_analyzer,
-        test_review_prompts,
-        test_config_loading,
-        test_environment_variables,
-        mock_github_api_test,
-        run_integration_test
-    ]
+        assert len(reviewer._match_regex_rules([("a.py", "password = 1\n")])[0]) == 1
+        # Unchanged content is answered from the cache without matching
+        reviewer._match_file_rules = Mock(side_effect=AssertionError("cache miss"))
+        assert len(reviewer._match_regex_rules([("a.py", "password = 1\n")])[0]) == 1
+        del reviewer._match_file_rules
+        # Changed content is matched again
+        assert not reviewer._match_regex_rules([("a.py", "x = 1\n")])
+    finally:
+        reviewer.close()
     
-    passed = 0
-    total = len(tests)
-    
-    for test in tests:
-        try:
-            test()
-            passed += 1
-            print()
-        except Exception as e:
-            print(f"❌ Test failed: {e}")
-            print()
+    # Changed rules discard every stored result
+    reviewer = make_reviewer(tmp_path, [dict(PASSWORD_RULE, pattern="x =")])
+    try:
+        assert len(reviewer._match_regex_rules([("a.py", "x = 1\n")])[0]) == 1
+    finally:
+        reviewer.close()
+
+def test_embedding_token_batches(aibot):
+    """Test embedding requests stay within the text count and token budget"""
+    texts = ["x" * 400] * 5  # about 100 tokens each
+    assert [len(batch) for batch in aibot.token_batches(texts, 250)] == [2, 2, 1]
+    assert all(len(batch) <= aibot.EMBEDDING_BATCH_SIZE for batch in aibot.token_batches(["x"] * 250, 10 ** 6))
+
+def test_rate_limiter(aibot, monkeypatch):
+    """Test the rate limiter waits out the minute once the token budget is used"""
+    clock = [0.0]
+    monkeypatch.setattr(aibot.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(aibot.time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    limiter = aibot.RateLimiter(max_rpm=10, max_tpm=100)
+    limiter.acquire(60)
+    assert clock[0] == 0
+    limiter.acquire(60)
+    assert clock[0] == 60
+    with pytest.raises(ValueError):
+        limiter.acquire(101)
+
+def test_integration():
+    """Run a basic integration test"""
+    # The bot module needs its runtime dependencies installed
+    pytest.importorskip("requests")
     
-    print(f"📊 Test Results: {passed}/{total} tests passed")
+    # Test importing all modules
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from code_review_bot import CodeReviewBot, GitHubAPIClient
     
-    if passed == total:
-        print("🎉 All tests passed! The bot is ready to use.")
-        return 0
-    else:
-        print("⚠️  Some tests failed. Please check the errors above.")
-        return 1
+    # Test basic functionality
+    assert DiffAnalyzer() is not None
+    assert get_manager() is not None
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(pytest.main([__file__]))
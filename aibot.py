@@ -4,9 +4,9 @@
 # bot that answers questions based on a private document.
 #
 # Setup Instructions:
-# 1. Make sure you have Python 3.8+ installed.
+# 1. Make sure you have Python 3.10+ installed.
 # 2. Install the required libraries:
-#    pip install langchain langchain_community langchain-google-genai faiss-cpu pypdf
+#    pip install langchain langchain_community langchain-google-genai faiss-cpu pypdf tiktoken
 #
 # 3. Get a Google AI API Key:
 #    - Go to https://aistudio.google.com/app/apikey
@@ -21,111 +21,647 @@
 #    - Update the `DOCUMENT_PATH` variable below to match your file's name.
 
 import os
+import json
+import asyncio
+import argparse
+import shutil
+import shelve
+import hashlib
 from getpass import getpass
 import time
+import threading
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Awaitable, Callable, Deque, List, NamedTuple, Optional, Tuple, cast
+
+# OpenMP reads these once, when FAISS and NumPy load, so they must be set first.
+# Idle threads sleep instead of spin-waiting between API calls, and the thread
+# count is capped to roughly the physical cores. Values already exported win.
+os.environ.setdefault("OMP_WAIT_POLICY", "PASSIVE")
+os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 2) // 2)))
+
+import faiss
+import numpy as np
 
 # --- Core LangChain components ---
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, GoogleGenerativeAI
-from langchain.prompts import PromptTemplate
-from langchain.chains.base import Chain
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStoreRetriever
 
 # --- Configuration ---
 DOCUMENT_PATH = "docs/1.pdf" # IMPORTANT: Change this to your PDF file name
 
+# PDFs with at least this many pages are parsed by several processes when PyMuPDF is installed
+PARALLEL_MIN_PAGES = 32
+
+# Splitting settings: max tokens in a chunk, and tokens shared between neighbouring chunks.
+# Sized to stay under the 2048-token input limit of the embedding model.
+CHUNK_SIZE = 1800
+CHUNK_OVERLAP = 200
+
+# Tokenizer used to measure chunks; it approximates the Gemini tokenizer closely enough for sizing
+SPLITTER_ENCODING = "cl100k_base"
+
+# Gemini model used to embed the chunks and the questions
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+
+# Most texts per embedding request; Gemini's batch embedding endpoint accepts up to 100.
+# Requests are also kept within the tokens-per-minute budget, so they usually hold fewer.
+EMBEDDING_BATCH_SIZE = 100
+
+# Attempts per embedding request before giving up on rate limit errors
+EMBEDDING_MAX_RETRIES = 3
+
+# Embedding requests in flight at once
+EMBEDDING_WORKERS = 4
+
+# Embedding rate limits of your Google AI tier (defaults: free tier), set via environment variables
+GOOGLE_MAX_RPM = int(os.getenv("GOOGLE_MAX_RPM", "100"))
+GOOGLE_MAX_TPM = int(os.getenv("GOOGLE_MAX_TPM", "30000"))
+
+# Rough characters per token, used to estimate the tokens in an embedding request
+CHARS_PER_TOKEN = 4
+
+# HNSW graph index settings: links per vector, and candidate list sizes while building and searching.
+# Raising HNSW_EF_SEARCH improves recall at the cost of query time; it needs no rebuild.
+# The graph stores vectors as float16, halving memory and bytes read per query.
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Large corpora use an IVF-PQ index instead, which keeps 8-bit product-quantized codes
+# (PQ_SUBQUANTIZERS bytes per vector) rather than full float32 vectors. PQ training needs
+# plenty of vectors, so smaller corpora stay on HNSW.
+PQ_MIN_VECTORS = 10000
+PQ_SUBQUANTIZERS = 64
+PQ_BITS = 8
+IVF_NPROBE = 8
+
+# Resources shared by indexes moved to a GPU; created on first use
+_gpu_resources = None
+
+# Gemini model that writes the answers
+LLM_MODEL = "models/gemini-2.5-pro"
+
+# Directory where built vector stores are saved, one sub-directory per document and settings
+INDEX_CACHE_DIR = ".rag_cache"
+
+# When a saved document changes, its new chunks are added to the saved index. Past this
+# share of new chunks, or when chunks were removed, the index is rebuilt from scratch.
+REBUILD_NEW_FRACTION = 0.5
+
+# Answers already given, keyed by question and the chunks retrieved for it
+ANSWER_CACHE_PATH = os.path.join(INDEX_CACHE_DIR, "answers")
+
+# Question embeddings already computed, kept on disk and, up to the given count, in memory
+QUERY_EMBEDDING_CACHE_PATH = os.path.join(INDEX_CACHE_DIR, "query_embeddings")
+QUERY_EMBEDDING_CACHE_SIZE = 10000
+
 # --- API Key Setup ---
 # Tries to get the API key from environment variables. If not found, prompts the user.
 if "GOOGLE_API_KEY" not in os.environ:
     print("Google API Key not found in environment variables.")
     os.environ["GOOGLE_API_KEY"] = getpass("Please enter your Google AI API Key: ")
 
-def create_rag_chain(document_path: str) -> Chain:
+def get_index_cache_dir(document_path: str) -> str:
     """
-    Creates the entire RAG chain from a document path.
-    This function handles loading, splitting, embedding, and chaining.
+    Returns the cache directory for a document's vector store.
+    The name is a hash of the document path and of every setting that changes
+    the stored vectors, so changing the settings builds a new store, while
+    editing the document updates the saved one.
+    """
+    digest = hashlib.sha256(os.path.abspath(document_path).encode("utf-8"))
+    digest.update(
+        f"|{SPLITTER_ENCODING}:{CHUNK_SIZE}|{CHUNK_OVERLAP}|{EMBEDDING_MODEL}|IP|HNSW{HNSW_M},{HNSW_EF_CONSTRUCTION},fp16"
+        f"|PQ{PQ_MIN_VECTORS},{PQ_SUBQUANTIZERS}x{PQ_BITS}".encode("utf-8")
+    )
+    return os.path.join(INDEX_CACHE_DIR, digest.hexdigest())
+
+def get_document_digest(document_path: str) -> str:
+    """Returns a hash of the PDF bytes, used to skip re-splitting an unchanged document."""
+    digest = hashlib.sha256()
+    with open(document_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class RateLimiter:
+    """
+    Paces requests to stay within a requests-per-minute and tokens-per-minute budget.
+    It remembers what was sent in the last minute and makes acquire() wait until
+    the next request fits, so requests are held back before they are sent
+    instead of being retried after a 429. Safe to share between threads.
+    """
+
+    def __init__(self, max_rpm: int, max_tpm: int):
+        self.max_rpm = max_rpm
+        self.max_tpm = max_tpm
+        self._sent: Deque[Tuple[float, int]] = deque()  # (time sent, tokens) of each request in the last minute
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        """Blocks until a request of the given size can be sent, then records it."""
+        if tokens > self.max_tpm:
+            raise ValueError(f"A request of ~{tokens} tokens can never fit the {self.max_tpm} tokens-per-minute budget.")
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0][0] >= 60:
+                    self._tokens -= self._sent.popleft()[1]
+                if len(self._sent) < self.max_rpm and self._tokens + tokens <= self.max_tpm:
+                    self._sent.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                wait_time = 60 - (now - self._sent[0][0])
+            time.sleep(wait_time)
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an embedding model so each distinct question is embedded only once.
+    Question vectors are scaled to unit length to match the inner-product index,
+    and kept in memory and on disk; chunk embeddings pass straight through,
+    since each vector store build embeds new text anyway.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str):
+        self.embeddings = embeddings
+        self.model = model
+        self._cached_embed_query = lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(self._embed_query)
+        # Batched retrieval embeds questions from several threads, and the shelf allows one writer
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return list(self._cached_embed_query(text))
+
+    def _embed_query(self, text: str) -> Tuple[float, ...]:
+        """Embeds a question, reusing a vector saved by an earlier session."""
+        key = hashlib.blake2b(f"{self.model}\0unit\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+        with self._lock, shelve.open(QUERY_EMBEDDING_CACHE_PATH) as cache:
+            if key in cache:
+                return cache[key]
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        vector = tuple((vector / max(np.linalg.norm(vector), 1e-12)).tolist())
+        with self._lock, shelve.open(QUERY_EMBEDDING_CACHE_PATH) as cache:
+            cache[key] = vector
+        return vector
+
+def estimate_tokens(texts: List[str]) -> int:
+    """Roughly estimates the tokens an embedding request for the texts uses."""
+    return sum(len(text) // CHARS_PER_TOKEN + 1 for text in texts)
+
+def token_batches(texts: List[str], max_tokens: int) -> List[List[str]]:
+    """
+    Groups texts, in order, into requests of at most EMBEDDING_BATCH_SIZE texts
+    whose estimated tokens stay within max_tokens.
+    """
+    batches: List[List[str]] = []
+    batch: List[str] = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens([text])
+        if batch and (len(batch) == EMBEDDING_BATCH_SIZE or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def embed_with_retry(embeddings: Embeddings, texts: List[str], limiter: RateLimiter) -> List[List[float]]:
+    """
+    Embeds a batch of texts in one request once the rate limiter allows it.
+    If the API still reports a rate limit error (429), for example because
+    the limits are set higher than the tier allows, it retries with
+    exponential backoff.
+    """
+    tokens = estimate_tokens(texts)
+    for attempt in range(EMBEDDING_MAX_RETRIES):
+        try:
+            limiter.acquire(tokens)
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            # Check if the error is a rate limit error (429)
+            if "429" in str(e) and attempt < EMBEDDING_MAX_RETRIES - 1:
+                wait_time = 2 ** (attempt + 1)  # Exponential backoff: 2s, 4s
+                print(f"    Rate limit hit. Waiting for {wait_time} seconds before retrying...")
+                time.sleep(wait_time)
+            else:
+                # If it's not a rate limit error or it's the final attempt, re-raise
+                print(f"    An unrecoverable error occurred during embedding: {e}")
+                raise e
+    raise ValueError(f"EMBEDDING_MAX_RETRIES must be at least 1, not {EMBEDDING_MAX_RETRIES}.")
+
+def create_faiss_index(vectors: np.ndarray) -> faiss.Index:
+    """
+    Creates an empty index, trained if needed, suited to the given vectors.
+    Corpora of at least PQ_MIN_VECTORS chunks get a compressed IVF-PQ index;
+    smaller ones get an HNSW graph over float16 copies of the vectors.
+    """
+    count, dimension = vectors.shape
+    if count >= PQ_MIN_VECTORS and dimension % PQ_SUBQUANTIZERS == 0:
+        nlist = int(np.sqrt(count))
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFPQ(
+            quantizer, dimension, nlist, PQ_SUBQUANTIZERS, PQ_BITS, faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(vectors)
+    else:
+        index = faiss.IndexHNSWSQ(
+            dimension, faiss.ScalarQuantizer.QT_fp16, HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.train(vectors)
+    set_search_params(index)
+    return index
+
+def set_search_params(index: faiss.Index) -> None:
+    """
+    Applies the query-time search settings, which can change without a rebuild.
+    """
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = IVF_NPROBE
+
+def move_index_to_gpu(index: faiss.Index) -> faiss.Index:
+    """
+    Returns a GPU copy of an IVF index when a GPU build of FAISS sees a device,
+    otherwise the index unchanged. HNSW graphs cannot run on the GPU, and IVF-PQ
+    layouts the GPU does not support fall back to the CPU index.
+    """
+    global _gpu_resources
+    if not isinstance(index, faiss.IndexIVF) or faiss.get_num_gpus() == 0:
+        return index
+    try:
+        if _gpu_resources is None:
+            _gpu_resources = faiss.StandardGpuResources()
+        return faiss.index_cpu_to_gpu(_gpu_resources, 0, index)
+    except (AttributeError, RuntimeError) as e:
+        print(f"    Keeping the index on the CPU: {e}")
+        return index
+
+def _extract_page_texts(document_path: str, start: int, stop: int) -> List[str]:
+    """
+    Extracts the text of pages start..stop-1 in a worker process.
+    """
+    import fitz
+    with fitz.open(document_path) as pdf:
+        return [pdf[page].get_text() for page in range(start, stop)]
+
+def load_pages(document_path: str) -> List[Document]:
+    """
+    Loads a PDF as one Document per page.
+    With PyMuPDF installed, large PDFs are parsed by a pool of processes, each
+    taking a contiguous range of pages; otherwise PyPDFLoader parses them in turn.
+    """
+    try:
+        import fitz
+    except ImportError:
+        return PyPDFLoader(document_path).load()
+
+    with fitz.open(document_path) as pdf:
+        page_count = pdf.page_count
+    workers = max(1, min((os.cpu_count() or 1) - 1, page_count // PARALLEL_MIN_PAGES))
+    if workers < 2:
+        texts = _extract_page_texts(document_path, 0, page_count)
+    else:
+        # One contiguous range per worker, merged back in page order
+        bounds = [page_count * i // workers for i in range(workers + 1)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = executor.map(_extract_page_texts, [document_path] * workers, bounds[:-1], bounds[1:])
+            texts = [text for part in parts for text in part]
+    return [
+        Document(page_content=text, metadata={"source": document_path, "page": page})
+        for page, text in enumerate(texts)
+    ]
+
+def chunk_hash(chunk: Document) -> str:
+    """Returns a hash of a chunk's text, which identifies it across runs."""
+    return hashlib.sha1(chunk.page_content.encode("utf-8")).hexdigest()
+
+def deduplicate_chunks(chunks: List[Document]) -> List[Document]:
+    """
+    Drops chunks whose text exactly repeats an earlier chunk, such as repeated
+    headers, footers, or boilerplate pages, keeping the first occurrence.
+    """
+    seen = set()
+    unique = []
+    for chunk in chunks:
+        digest = chunk_hash(chunk)
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(chunk)
+    return unique
+
+def split_document(document_path: str) -> List[Document]:
+    """
+    Loads a document and splits it into unique chunks.
     """
     print(f"1. Loading document from: {document_path}")
-    # Load the document. PyPDFLoader splits the PDF into pages.
-    loader = PyPDFLoader(document_path)
-    documents = loader.load()
+    # Load the document, one Document per page.
+    documents = load_pages(document_path)
 
     if not documents:
         raise ValueError(f"Could not load any documents from {document_path}. Check the file path and content.")
 
     print("2. Splitting the document into smaller chunks.")
     # Split documents into smaller, semantically meaningful chunks.
-    # chunk_size: max characters in a chunk
-    # chunk_overlap: characters to overlap between chunks to maintain context
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
+    # chunk_size: max tokens in a chunk, so chunks fill but never exceed the embedding input
+    # chunk_overlap: tokens to overlap between chunks to maintain context
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=SPLITTER_ENCODING, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+    )
     chunks = text_splitter.split_documents(documents)
 
     if not chunks:
         raise ValueError("Text splitting resulted in no chunks. The document might be empty or unreadable.")
 
+    # Identical chunks would cost an embedding each and return the same text twice
+    unique_chunks = deduplicate_chunks(chunks)
+    if len(unique_chunks) < len(chunks):
+        print(f"  - Skipping {len(chunks) - len(unique_chunks)} duplicate chunk(s).")
+    return unique_chunks
+
+def embed_chunks(chunks: List[Document], embeddings: Embeddings) -> np.ndarray:
+    """
+    Embeds chunk texts in rate-limited parallel batches.
+    Returns one unit-length float32 vector per chunk, in chunk order.
+    """
+    # --- RATE LIMITING & RETRY IMPLEMENTATION ---
+    # The free tier for Google AI has a strict rate limit. We embed the chunk
+    # texts in batches, each sent as one batch embedding request and each small
+    # enough to fit the per-minute token budget, with up to EMBEDDING_WORKERS
+    # requests in flight. A shared limiter paces them to the
+    # GOOGLE_MAX_RPM / GOOGLE_MAX_TPM budget.
+    limiter = RateLimiter(GOOGLE_MAX_RPM, GOOGLE_MAX_TPM)
+    texts = [c.page_content for c in chunks]
+    batches = token_batches(texts, limiter.max_tpm)
+    print(f"  - Embedding {len(batches)} batch(es), up to {EMBEDDING_WORKERS} at a time...")
+
+    vectors = []
+    with ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS) as executor:
+        futures = [executor.submit(embed_with_retry, embeddings, batch, limiter) for batch in batches]
+        # Collect in submission order so each vector lines up with its text
+        for current_batch_num, future in enumerate(futures, 1):
+            vectors.extend(future.result())
+            print(f"  - Processed batch {current_batch_num}/{len(batches)}")
+
+    # Unit-length vectors make the inner product equal to cosine similarity,
+    # which FAISS computes with a single matrix multiply instead of L2 distances.
+    vectors = np.asarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def build_vector_store(chunks: List[Document], embeddings: Embeddings) -> FAISS:
+    """
+    Embeds chunks into a new FAISS vector store.
+    """
     print("3. Creating text embeddings and storing them in a FAISS vector store.")
     # Create embeddings for each chunk and store them in a FAISS vector store.
     # This is the "database" for our semantic search.
-    # The Gemini embedding model "models/embedding-001" is used here.
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
+    vectors = embed_chunks(chunks, embeddings)
 
-    # --- RATE LIMITING & RETRY IMPLEMENTATION ---
-    # The free tier for Google AI has a strict rate limit. To avoid errors,
-    # we process the document chunks in small batches and add delays.
-    # This is not a special "batch API"; it's a client-side strategy to
-    # control the rate of standard API calls gracefully.
-    batch_size = 40  # Smaller batch size for more controlled requests
-    vector_store = None
-    max_retries = 3
-
-    for i in range(0, len(chunks), batch_size):
-        batch_chunks = chunks[i:i + batch_size]
-        current_batch_num = (i // batch_size) + 1
-        total_batches = (len(chunks) + batch_size - 1) // batch_size
-        print(f"  - Processing batch {current_batch_num}/{total_batches}...")
-
-        for attempt in range(max_retries):
+    # Store the vectors in an HNSW graph (or IVF-PQ for big corpora) so a search
+    # visits a small part of the index instead of comparing against every chunk.
+    vector_store = FAISS(
+        embedding_function=embeddings,
+        index=create_faiss_index(vectors),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
+    vector_store.add_embeddings(
+        [(c.page_content, v) for c, v in zip(chunks, vectors)], metadatas=[c.metadata for c in chunks]
+    )
+    return vector_store
+
+def add_new_chunks(vector_store: FAISS, manifest: dict, chunks: List[Document], embeddings: Embeddings) -> bool:
+    """
+    Embeds only the chunks missing from a saved store and adds them to it.
+    Returns False, leaving the store untouched, when it should be rebuilt
+    instead: when chunks were removed, which an HNSW graph cannot drop, or
+    when more than REBUILD_NEW_FRACTION of the chunks are new.
+    """
+    known = manifest["chunks"]
+    hashes = [chunk_hash(c) for c in chunks]
+    if not known.keys() <= set(hashes):
+        return False
+    new_chunks = [c for c, h in zip(chunks, hashes) if h not in known]
+    if len(new_chunks) > REBUILD_NEW_FRACTION * len(chunks):
+        return False
+    if new_chunks:
+        print(f"3. Adding {len(new_chunks)} new chunk(s) to the saved vector store.")
+        vectors = embed_chunks(new_chunks, embeddings)
+        vector_store.add_embeddings(
+            [(c.page_content, v) for c, v in zip(new_chunks, vectors)], metadatas=[c.metadata for c in new_chunks]
+        )
+    return True
+
+def load_vector_store(cache_dir: str, embeddings: Embeddings) -> Optional[Tuple[FAISS, dict]]:
+    """
+    Loads a saved vector store and its manifest, or returns None when there
+    is no complete store in the cache.
+    """
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    # The store was written by this script, so unpickling its docstore is safe
+    vector_store = FAISS.load_local(
+        cache_dir,
+        embeddings,
+        allow_dangerous_deserialization=True,
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
+    return vector_store, manifest
+
+def save_vector_store(vector_store: FAISS, chunks: List[Document], cache_dir: str, document_digest: str) -> None:
+    """
+    Saves a vector store to the cache, plus its chunks as JSON for inspection
+    and a manifest mapping each chunk hash to its vector id in the index.
+    The files are written to a temporary directory that is renamed into place,
+    so an interrupted run never leaves a partial store behind.
+    """
+    temp_dir = f"{cache_dir}.{os.getpid()}.tmp"
+    old_dir = f"{cache_dir}.{os.getpid()}.old"
+    vector_store.save_local(temp_dir)
+    with open(os.path.join(temp_dir, "chunks.json"), "w", encoding="utf-8") as f:
+        json.dump([{"text": c.page_content, "metadata": c.metadata} for c in chunks], f, ensure_ascii=False, indent=1)
+    manifest = {
+        "document": document_digest,
+        "chunks": {
+            chunk_hash(vector_store.docstore.search(doc_id)): vector_id
+            for vector_id, doc_id in vector_store.index_to_docstore_id.items()
+        },
+    }
+    with open(os.path.join(temp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    try:
+        # A directory cannot be renamed over a non-empty one, so set the saved store aside first
+        if os.path.isdir(cache_dir):
+            os.replace(cache_dir, old_dir)
+        os.replace(temp_dir, cache_dir)
+    except OSError as e:
+        # Keep whichever store is in place: the previous one, or one another run saved first
+        if os.path.isdir(old_dir) and not os.path.exists(cache_dir):
+            os.replace(old_dir, cache_dir)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        print(f"  - Could not save the vector store, keeping the existing one: {e}")
+    else:
+        # The new store is in place, so the previous one can go
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+def answer_cache_key(question: str, retrieved_docs: List[Document], prompt_template: str) -> str:
+    """
+    Returns the answer cache key for a question and the chunks retrieved for it.
+    Case and spacing of the question are ignored; the model, the prompt, and the
+    retrieved text (in order) all count, since each of them changes the answer.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    normalized_question = " ".join(question.lower().split())
+    for part in (LLM_MODEL, prompt_template, normalized_question, *(doc.page_content for doc in retrieved_docs)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class SwapIndex:
+    """
+    Holds the retriever that queries read, so a vector store for an updated
+    document can be built in a background thread and swapped in without
+    blocking the questions asked in the meantime. The outcome of each
+    rebuild is kept for the session to show between answers.
+    """
+
+    def __init__(self, retriever: VectorStoreRetriever):
+        self.retriever = retriever
+        self.lock = threading.RLock()
+        self._rebuilding = threading.Lock()
+        self._updates: Deque[str] = deque()
+
+    def take_updates(self) -> List[str]:
+        """Returns and forgets the rebuild outcomes recorded since the last call."""
+        updates = []
+        while self._updates:
+            updates.append(self._updates.popleft())
+        return updates
+
+    def get(self) -> VectorStoreRetriever:
+        with self.lock:
+            return self.retriever
+
+    def rebuild_in_background(self, build: Callable[[], VectorStoreRetriever]) -> bool:
+        """
+        Runs build() in a background thread and swaps in the retriever it
+        returns. Returns False without starting when a rebuild is running.
+        """
+        if not self._rebuilding.acquire(blocking=False):
+            return False
+
+        def run() -> None:
             try:
-                if vector_store is None:
-                    # Create the vector store with the first batch
-                    vector_store = FAISS.from_documents(batch_chunks, embeddings)
-                else:
-                    # Add subsequent batches to the existing store
-                    vector_store.add_documents(batch_chunks)
-                
-                # If successful, break the retry loop and move to the next batch
-                break
+                retriever = build()
+                with self.lock:
+                    self.retriever = retriever
+                self._updates.append("(The vector store was updated for the changed document.)")
             except Exception as e:
-                # Check if the error is a rate limit error (429)
-                if "429" in str(e) and attempt < max_retries - 1:
-                    wait_time = 2 ** (attempt + 1)  # Exponential backoff: 2s, 4s
-                    print(f"    Rate limit hit. Waiting for {wait_time} seconds before retrying...")
-                    time.sleep(wait_time)
-                else:
-                    # If it's not a rate limit error or it's the final attempt, re-raise
-                    print(f"    An unrecoverable error occurred during embedding: {e}")
-                    raise e
-        
-        # Add a small delay between successful batches to respect the API limits
-        if current_batch_num < total_batches:
-             print("  - Waiting for 1 second before the next batch...")
-             time.sleep(1)
+                self._updates.append(f"Could not update the vector store, keeping the current one: {e}")
+            finally:
+                self._rebuilding.release()
 
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+def load_or_build_vector_store(document_path: str, embeddings: Embeddings) -> FAISS:
+    """
+    Returns a search-ready vector store for the document. A store built
+    earlier for the same document and settings is loaded from the cache
+    instead of being embedded again; if the document changed since, only
+    its new chunks are embedded and added.
+    """
+    cache_dir = get_index_cache_dir(document_path)
+    document_digest = get_document_digest(document_path)
+    saved = load_vector_store(cache_dir, embeddings)
+    if saved is not None and saved[1]["document"] == document_digest:
+        print(f"1-3. Loaded the saved vector store from: {cache_dir}")
+        vector_store = saved[0]
+    else:
+        chunks = split_document(document_path)
+        if saved is not None and add_new_chunks(saved[0], saved[1], chunks, embeddings):
+            vector_store = saved[0]
+        else:
+            vector_store = build_vector_store(chunks, embeddings)
+        save_vector_store(vector_store, chunks, cache_dir, document_digest)
+    # The search breadth is a query-time setting, so apply the current value
+    set_search_params(vector_store.index)
+    # Only the saved copy has to stay on the CPU, so search on a GPU when there is one
+    vector_store.index = move_index_to_gpu(vector_store.index)
+    return vector_store
+
+class RagChain(NamedTuple):
+    """The question-answering entry points returned by create_rag_chain."""
+    ask: Callable[[str], Awaitable[str]]
+    batch: Callable[[List[str]], Awaitable[List[str]]]
+    updates: Callable[[], List[str]]
+
+def create_rag_chain(document_path: str) -> RagChain:
+    """
+    Creates the entire RAG chain from a document path.
+    This function handles loading, splitting, embedding, and chaining.
+    When the document changes while the chain is in use, its vector store
+    is updated in the background and swapped in once ready.
+    """
+    # The Gemini embedding model "models/gemini-embedding-001" is used here.
+    # Repeated questions reuse their embedding instead of calling the API again.
+    os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+    embeddings = CachedQueryEmbeddings(GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
 
-    print("4. Creating a retriever for searching the vector store.")
     # A retriever is a component that fetches the most relevant documents
     # from the vector store based on a user's query.
     # k=3 means it will retrieve the top 3 most relevant chunks.
-    retriever = vector_store.as_retriever(search_kwargs={"k": 3})
+    def build_retriever() -> VectorStoreRetriever:
+        return load_or_build_vector_store(document_path, embeddings).as_retriever(search_kwargs={"k": 3})
+
+    # Modification time of the document the last update was started for. A failed
+    # update is not retried, and its embedding cost not repeated, until the document changes again.
+    attempted_mtime = os.path.getmtime(document_path)
+    retriever = build_retriever()
+    print("4. Creating a retriever for searching the vector store.")
+    swap = SwapIndex(retriever)
+
+    # Checked before each question; the current index keeps serving while the update runs
+    def refresh_if_changed() -> None:
+        nonlocal attempted_mtime
+        try:
+            mtime = os.path.getmtime(document_path)
+        except OSError:
+            # The document is being replaced, e.g. saved atomically by an editor; check at the next question
+            return
+        # While an update is running, a newer change is picked up at a later question
+        if mtime != attempted_mtime and swap.rebuild_in_background(build_retriever):
+            attempted_mtime = mtime
 
     print("5. Setting up the LLM and the prompt template.")
     # Initialize the Gemini Pro model for generation.
-    llm = GoogleGenerativeAI(model="models/gemini-2.5-pro")
+    llm = GoogleGenerativeAI(model=LLM_MODEL)
 
     # The prompt template is crucial. It instructs the LLM how to behave.
     # It takes the retrieved "context" (the chunks) and the "question"
     # and formats them into a single prompt for the LLM.
+    # Plain %-formatting fills the two fields faster than PromptTemplate.format.
     prompt_template = """
     You are a helpful assistant who answers questions based on the provided context.
     Synthesize the information from all relevant pieces of the context to provide a complete and comprehensive answer.
@@ -133,14 +669,19 @@ def create_rag_chain(document_path: str) -> Chain:
     Do not make up information.
 
     CONTEXT:
-    {context}
+    %s
 
     QUESTION:
-    {question}
+    %s
 
     ANSWER:
     """
-    prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
+
+    def format_prompt(question: str, retrieved_docs: List[Document]) -> str:
+        # Format the retrieved docs into a single string for the context.
+        formatted_context = "\n\n".join([doc.page_content for doc in retrieved_docs])
+        # Fill the prompt template
+        return prompt_template % (formatted_context, question)
 
     # This is where we define the RAG chain using a simplified syntax.
     # It's a pipeline that:
@@ -149,21 +690,90 @@ def create_rag_chain(document_path: str) -> Chain:
     # 3. The context and question are formatted by the prompt.
     # 4. The formatted prompt is sent to the LLM.
     # 5. The LLM generates the final answer.
-    def rag_chain(question: str):
-        retrieved_docs = retriever.invoke(question)
-        # Format the retrieved docs into a single string for the context.
-        formatted_context = "\n\n".join(doc.page_content for doc in retrieved_docs)
-        # Fill the prompt template
-        formatted_prompt = prompt.format(context=formatted_context, question=question)
-        # Get the answer from the LLM
-        answer = llm.invoke(formatted_prompt)
+    # The answer is printed as the LLM streams it, and also returned in full.
+    # A question already answered from the same chunks is served from the answer cache.
+    # The chain is async so that the network waits of concurrent questions overlap.
+    async def rag_chain(question: str) -> str:
+        refresh_if_changed()
+        retrieved_docs = await swap.get().ainvoke(question)
+        key = answer_cache_key(question, retrieved_docs, prompt_template)
+        with shelve.open(ANSWER_CACHE_PATH) as answer_cache:
+            if key in answer_cache:
+                print(answer_cache[key], flush=True)
+                return answer_cache[key]
+        # Stream the answer from the LLM token by token
+        buf = []
+        async for chunk in llm.astream(format_prompt(question, retrieved_docs)):
+            print(chunk, end="", flush=True)
+            buf.append(chunk)
+        print()
+        answer = "".join(buf)
+        with shelve.open(ANSWER_CACHE_PATH) as answer_cache:
+            answer_cache[key] = answer
         return answer
 
+    # The same pipeline for many questions at once: retrieval runs as one
+    # batch, and only the questions missing from the answer cache are sent
+    # to the LLM, together in a single batch call.
+    async def rag_chain_batch(questions: List[str]) -> List[str]:
+        refresh_if_changed()
+        docs_lists = await swap.get().abatch(questions)
+        keys = [answer_cache_key(q, docs, prompt_template) for q, docs in zip(questions, docs_lists)]
+        with shelve.open(ANSWER_CACHE_PATH) as answer_cache:
+            answers: List[Optional[str]] = [answer_cache.get(key) for key in keys]
+        missing = [i for i, answer in enumerate(answers) if answer is None]
+        if missing:
+            prompts = [format_prompt(questions[i], docs_lists[i]) for i in missing]
+            # Keep the shelf closed during the network calls so other readers are not locked out
+            generated = await llm.abatch(prompts)
+            with shelve.open(ANSWER_CACHE_PATH) as answer_cache:
+                for i, answer in zip(missing, generated):
+                    answers[i] = answer_cache[keys[i]] = answer
+        # Every question now has an answer, either cached or just generated
+        return cast(List[str], answers)
+
     print("✅ RAG chain created successfully!")
-    return rag_chain
+    return RagChain(ask=rag_chain, batch=rag_chain_batch, updates=swap.take_updates)
+
+async def run_session(batch_file: Optional[str] = None) -> None:
+    """Answers the questions in batch_file, or runs the interactive session."""
+    chain = create_rag_chain(DOCUMENT_PATH)
+
+    if batch_file:
+        with open(batch_file, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        print(f"Answering {len(questions)} questions from '{batch_file}'...")
+        for question, answer in zip(questions, await chain.batch(questions)):
+            print(f"\nQuestion: {question}\nAnswer: {answer}")
+        for update in chain.updates():
+            print(f"\n{update}")
+        return
+
+    print("\n--- Document Q&A Bot ---")
+    print("Ask questions about the content of your document.")
+    print("Type 'exit' or 'quit' to end the session.")
 
-def main():
+    while True:
+        # Background rebuilds report here rather than in the middle of a streamed answer
+        for update in chain.updates():
+            print(f"\n{update}")
+        # Read input in a worker thread so the event loop is never blocked
+        question = await asyncio.to_thread(input, "\nYour Question: ")
+        if question.lower() in ["exit", "quit"]:
+            break
+        if not question.strip():
+            continue
+
+        print("\nAnswer: ", end="", flush=True)
+        # Invoke the chain, which prints the answer as it is generated
+        await chain.ask(question)
+
+def main() -> None:
     """Main function to run the Q&A bot."""
+    parser = argparse.ArgumentParser(description="Answer questions about a PDF document.")
+    parser.add_argument("--batch-file", help="Answer every question in this file (one per line) and exit.")
+    args = parser.parse_args()
+
     # A simple check to see if a dummy document exists.
     # You should replace 'sample_document.pdf' with your actual file.
     if not os.path.exists(DOCUMENT_PATH):
@@ -187,24 +797,7 @@ def main():
             return
 
     try:
-        chain = create_rag_chain(DOCUMENT_PATH)
-
-        print("\n--- Document Q&A Bot ---")
-        print("Ask questions about the content of your document.")
-        print("Type 'exit' or 'quit' to end the session.")
-
-        while True:
-            question = input("\nYour Question: ")
-            if question.lower() in ["exit", "quit"]:
-                break
-            if not question.strip():
-                continue
-
-            print("Thinking...")
-            # Invoke the chain to get the answer
-            answer = chain(question)
-            print("\nAnswer:", answer)
-
+        asyncio.run(run_session(args.batch_file))
     except Exception as e:
         print(f"\nAn error occurred: {e}")
         print("Please check your API key, file path, and internet connection.")